@@ -1,4 +1,6 @@
 from .logs import Logs
 
-def setup(bot):
-    bot.add_cog(Logs(bot))
\ No newline at end of file
+async def setup(bot):
+    cog = Logs(bot)
+    await cog.initialize()
+    bot.add_cog(cog)
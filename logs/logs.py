@@ -1,10 +1,19 @@
+import asyncio
+import inspect
 import logging
+import sqlite3
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Optional, Union
 
+import aiohttp
 import discord
-import requests
+from discord.http import Route
 from redbot.core import Config, commands, checks
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
 from tabulate import tabulate
 
 logger = logging.getLogger("red.zaap-plugins.logs")
@@ -35,6 +44,25 @@ _TRIGGERS = {
     "discord.guilds.offline": "Déconnexions de serveurs"
 }
 
+_STATUS_URL = "https://srhpyqt94yxb.statuspage.io/api/v2/status.json"
+_STATUS_DELAY = 300 # Secondes entre deux vérifications du statut de Discord
+_STATUS_MAX_BACKOFF = 3600 # Attente maximale après des échecs successifs
+_MAX_EMBEDS = 10 # Embeds maximum par message
+_MAX_EMBEDS_LENGTH = 6000 # Caractères maximum de l'ensemble des embeds d'un message
+_QUEUE_SIZE = 500 # Logs maximum en attente par salon, les suivants sont abandonnés
+_SEND_RETRIES = 4 # Tentatives d'envoi d'un message de logs avant abandon
+_WORKER_IDLE = 300 # Secondes d'inactivité avant l'arrêt du worker d'un salon
+_ARCHIVE_DELAY = 5 # Secondes entre deux écritures des évènements en attente dans l'archive
+_ARCHIVE_BATCH = 500 # Évènements en attente déclenchant une écriture immédiate
+_ARCHIVE_RETENTION = 90 # Jours de conservation des évènements archivés
+_SEARCH_LIMIT = 250 # Résultats maximum affichés par une recherche
+_CACHE_CHANNEL_BYTES = 256 * 1024 # Octets maximum de messages gardés en mémoire par salon
+_CACHE_OVERHEAD = 120 # Estimation en octets de la place prise par un message en plus de son contenu
+_RAID_WINDOW = 10 # Secondes sur lesquelles le rythme des arrivées/départs est mesuré
+_DIGEST_DELAY = 15 # Secondes entre deux résumés en mode raid
+_DIGEST_SIZE = 20 # Membres maximum par résumé
+_MULTI_EMBEDS = "embeds" in inspect.signature(discord.abc.Messageable.send).parameters
+
 class LogsError(Exception):
     pass
 
@@ -44,6 +72,52 @@ class CouldNotSend(LogsError):
 class ChannelError(LogsError):
     pass
 
+class CachedMessage:
+    """Version compacte d'un message, gardée pour pouvoir logger sa suppression ou son édition"""
+    __slots__ = ("id", "author_id", "channel_id", "content", "attachments", "size")
+
+    def __init__(self, message: discord.Message):
+        self.id = message.id
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.content = message.content
+        self.attachments = tuple(a.url for a in message.attachments)
+        self.size = _CACHE_OVERHEAD + len(self.content.encode()) + sum(len(url) for url in self.attachments)
+
+class MessageRing:
+    """Derniers messages d'un salon, les plus anciens étant oubliés au-delà de `max_bytes` octets"""
+
+    def __init__(self, max_bytes: int = _CACHE_CHANNEL_BYTES):
+        self.messages = OrderedDict()
+        self.bytes = 0
+        self.max_bytes = max_bytes
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, record: CachedMessage):
+        self.pop(record.id)
+        self.messages[record.id] = record
+        self.bytes += record.size
+        while self.bytes > self.max_bytes and self.messages:
+            self.bytes -= self.messages.popitem(last=False)[1].size
+
+    def get(self, message_id: int):
+        return self.messages.get(message_id)
+
+    def pop(self, message_id: int):
+        record = self.messages.pop(message_id, None)
+        if record:
+            self.bytes -= record.size
+        return record
+
+    def update(self, message_id: int, content: str):
+        record = self.pop(message_id)
+        if record:
+            record.size += len(content.encode()) - len(record.content.encode())
+            record.content = content
+            self.add(record)
+
 class Logs(commands.Cog):
     """Module de logging des évènements discord (& des utilisations de commandes)"""
 
@@ -53,57 +127,413 @@ class Logs(commands.Cog):
 
         self.config = Config.get_conf(self, identifier=736144321857978388, force_registration=True)
         default_guild = {"channels": {},
-                         "colors": {}}
+                         "colors": {},
+                         "delay": 1.5, # Secondes pendant lesquelles les logs d'un salon sont regroupés
+                         "raid_threshold": 8} # Arrivées ou départs en 10s déclenchant les résumés, 0 = jamais
+        default_global = {"concurrency": 25} # Serveurs traités en même temps lors d'un log global
         self.config.register_guild(**default_guild)
-        self.channels = {}
-        self.delays = {"discord_status": 0, "status_cd": 0, "status_mode": False, "guilds_disconnect": 0}
+        self.config.register_global(**default_global)
+        self.profiles = {}
+        self.subscribers = {}
+        self.concurrency = asyncio.Semaphore(default_global["concurrency"])
+        self.delays = {"status_cd": 0, "status_mode": False, "guilds_disconnect": 0}
+
+        self.queues = {}
+        self.workers = {}
+        self.metrics = {}
+
+        self.message_cache = {}
+        self.rates = {}
+        self.digests = {}
+        self.archive_rows = []
+        self.archive_pool = ThreadPoolExecutor(max_workers=1) # Une seule connexion SQLite, toujours dans ce thread
+        self.archive_db = None
+
+        self.session = None
+        self.background_loop = None
+        self.archive_loop_task = None
+
+    async def initialize(self):
+        self.concurrency = asyncio.Semaphore(await self.config.concurrency())
+        for guild_id, data in (await self.config.all_guilds()).items():
+            self.update_subscriptions(guild_id, data.get("channels", {}))
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15, connect=5))
+        self._enable_bg_loop()
+
+    def _enable_bg_loop(self):
+        self.background_loop = self.bot.loop.create_task(self.loop())
+        self.archive_loop_task = self.bot.loop.create_task(self.archive_loop())
+
+        def error_handler(future: asyncio.Future):
+            try:
+                future.result()
+            except asyncio.CancelledError:
+                pass
+            except Exception as exc:
+                logger.exception(
+                    "Erreur dans la loop de Logs: ",
+                    exc_info=exc,
+                )
+        self.background_loop.add_done_callback(error_handler)
+        self.archive_loop_task.add_done_callback(error_handler)
+
+    async def loop(self):
+        await self.bot.wait_until_ready()
+        failures = 0
+        while True:
+            try:
+                status, page = await self.fetch_discord_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError):
+                failures += 1
+                delay = min(_STATUS_DELAY * 2 ** failures, _STATUS_MAX_BACKOFF)
+                logger.info(f"Statut de Discord indisponible, nouvel essai dans {delay}s", exc_info=True)
+            else:
+                failures = 0
+                delay = _STATUS_DELAY
+                await self.check_discord_status(status, page)
+            await self.refresh_default_colors()
+            await asyncio.sleep(delay)
+
+    async def archive_loop(self):
+        last_prune = 0
+        while True:
+            await asyncio.sleep(_ARCHIVE_DELAY)
+            await self.flush_archive()
+            if last_prune + 3600 < time.time():
+                last_prune = time.time()
+                await self.bot.loop.run_in_executor(self.archive_pool, self._prune_archive,
+                                                    time.time() - _ARCHIVE_RETENTION * 86400)
+
+    def cog_unload(self):
+        if self.background_loop:
+            self.background_loop.cancel()
+        if self.archive_loop_task:
+            self.archive_loop_task.cancel()
+        for digest in self.digests.values():
+            digest["task"].cancel()
+        rows, self.archive_rows = self.archive_rows, []
+        if rows:
+            self.archive_pool.submit(self._write_archive, rows)
+        self.archive_pool.submit(self._close_archive)
+        self.archive_pool.shutdown(wait=False)
+        for task in self.workers.values():
+            task.cancel()
+        for channel, queue in self.queues.values(): # Envoi des logs restants
+            embeds = []
+            while not queue.empty():
+                embeds.append(queue.get_nowait()[0])
+            if embeds:
+                asyncio.create_task(self.deliver(channel, embeds))
+        if self.session:
+            asyncio.create_task(self.session.close())
+
+    async def fetch_discord_status(self):
+        """Renvoie l'indicateur de statut de Discord et l'URL de la page de statut"""
+        async with self.session.get(_STATUS_URL) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        return data["status"]["indicator"], data["page"]["url"]
+
+    async def check_discord_status(self, status: str, page: str):
+        """Envoie un log global lorsque Discord connaît (ou ne connaît plus) des instabilités"""
+        ts = datetime.utcnow()
+        if status != "none":
+            if self.delays["status_cd"] <= time.time():
+                self.delays["status_cd"] = time.time() + 3600
+                if not self.delays["status_mode"]:
+                    self.delays["status_mode"] = True
+                    em = discord.Embed(description=f"Les serveurs de Discord connaissent actuellement des instabilités.\n"
+                                                   f"Consultez {page} pour plus d'infos.", timestamp=ts)
+                    em.set_author(name="Instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
+                    em.set_footer(text=f"Message global")
+                else:
+                    em = discord.Embed(
+                        description=f"Les perturbations sur les serveurs Discord se poursuivent.\n"
+                                    f"Consultez {page} pour plus d'infos.", timestamp=ts)
+                    em.set_author(name="Instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
+                    em.set_footer(text=f"Message global")
+                await self.global_logging("discord.status", em)
+        elif self.delays["status_mode"]:
+            self.delays["status_mode"] = False
+            em = discord.Embed(description=f"Les perturbations des serveurs Discord semblent avoir été résolus.\n"
+                                           f"Consultez {page} pour plus d'infos.", timestamp=ts)
+            em.set_author(name="Fin des instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
+            em.set_footer(text=f"Message global")
+            await self.global_logging("discord.status", em)
+
+    def update_subscriptions(self, guild_id: int, channels: dict):
+        """Met à jour l'ensemble des serveurs abonnés à chaque trigger"""
+        for trigger, guilds in self.subscribers.items():
+            if trigger not in channels:
+                guilds.discard(guild_id)
+        for trigger, ids in channels.items():
+            if ids:
+                self.subscribers.setdefault(trigger, set()).add(guild_id)
+
+    def humanize_size(self, b: int):
+        if b > 1000:
+            kb = round(b / 1e3, 2)
+            if kb > 1000:
+                mb = round(b / 1e6, 2)
+                return f"{mb} MB"
+            return f"{kb} KB"
+        return f"{b} B"
+
+    async def load_profile(self, guild: discord.Guild):
+        """Charge en mémoire tout ce dont l'envoi des logs du serveur a besoin
+
+        Salons liés à chaque trigger, couleurs personnalisées, couleur par défaut du bot sur le serveur et délai de
+        regroupement : l'envoi d'un log ne lit ainsi plus rien dans Config"""
+        data = await self.config.guild(guild).all()
+        self.update_subscriptions(guild.id, data["channels"])
+        all_channels = guild.text_channels
+        channels = {}
+        for trig in data["channels"]:
+            channels[trig] = [chan for chan in all_channels if chan.id in data["channels"][trig]]
+        self.profiles[guild.id] = {"channels": channels,
+                                   "colors": data["colors"],
+                                   "default_color": await self.bot.get_embed_color(
+                                       all_channels[0] if all_channels else guild),
+                                   "delay": data["delay"],
+                                   "raid_threshold": data["raid_threshold"]}
+        return self.profiles[guild.id]
+
+    async def get_profile(self, guild: discord.Guild):
+        if guild.id not in self.profiles:
+            return await self.load_profile(guild)
+        return self.profiles[guild.id]
 
     async def preload_channels(self, guild: discord.Guild):
         """Charge d'avance les salons pour fluidifier l'envoi des logs"""
-        loadcache = {}
-        all_channels = guild.text_channels
-        triggers = await self.config.guild(guild).channels()
-        for trig in triggers:
-            loadcache[trig] = [chan for chan in all_channels if chan.id in triggers[trig]]
-        self.channels[guild.id] = loadcache
-        return self.channels[guild.id]
+        return (await self.load_profile(guild))["channels"]
 
     async def get_preloaded_channels(self, guild: discord.Guild):
-        if guild.id not in self.channels:
-            return await self.preload_channels(guild)
-        return self.channels[guild.id]
-
-    async def manage_logging(self, guild: discord.Guild, trigger: str, content: discord.Embed):
-        """Gère l'envoi des logs sur les channels liés du serveur"""
-        triggers = await self.get_preloaded_channels(guild)
-        if trigger.lower() in triggers:
-            channels = triggers[trigger.lower()]
-            colors = await self.config.guild(guild).colors()
-            for chan in channels:
-                try:
-                    if colors.get(trigger.lower(), False):
-                        content.colour = colors[trigger.lower()]
-                    else:
-                        content.colour = await self.bot.get_embed_color(chan)
-                    await chan.send(embed=content)
-                    return True
-                except:
-                    raise CouldNotSend(f"Un log du trigger {trigger} n'a pas pu être envoyé sur {chan.mention}")
+        return (await self.get_profile(guild))["channels"]
+
+    async def refresh_default_colors(self):
+        """Met à jour la couleur par défaut des profils chargés (si elle a été modifiée avec les commandes de Red)"""
+        for guild_id, profile in list(self.profiles.items()):
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                profile["default_color"] = await self.bot.get_embed_color(
+                    guild.text_channels[0] if guild.text_channels else guild)
+
+    async def send_embeds(self, channel: discord.TextChannel, embeds: list):
+        """Envoie plusieurs embeds dans un seul message
+
+        discord.py 1.x ne permet pas d'envoyer plusieurs embeds avec send(), la requête est alors faite directement"""
+        if len(embeds) == 1:
+            return await channel.send(embed=embeds[0])
+        if _MULTI_EMBEDS:
+            return await channel.send(embeds=embeds)
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel.id)
+        return await self.bot.http.request(route, json={"embeds": [em.to_dict() for em in embeds]})
+
+    def group_embeds(self, embeds: list) -> list:
+        """Répartit les embeds en messages de 10 embeds et 6000 caractères maximum"""
+        groups, length = [], 0
+        for em in embeds:
+            if not groups or len(groups[-1]) >= _MAX_EMBEDS or length + len(em) > _MAX_EMBEDS_LENGTH:
+                groups.append([])
+                length = 0
+            groups[-1].append(em)
+            length += len(em)
+        return groups
+
+    async def send_with_retry(self, channel: discord.TextChannel, embeds: list):
+        """Envoie un message de logs en réessayant après une attente croissante si Discord ne répond pas
+
+        Renvoie True si le message a été envoyé, None si Discord l'a refusé (requête invalide) et False en cas d'échec
+        définitif (salon supprimé, permissions manquantes, échecs répétés)"""
+        metrics = self.metrics.setdefault(channel.id, {"sent": 0, "dropped": 0, "failed": 0, "retries": 0})
+        for attempt in range(_SEND_RETRIES):
+            if attempt:
+                metrics["retries"] += 1
+                await asyncio.sleep(2 ** attempt)
+            try:
+                await self.send_embeds(channel, embeds)
+            except (discord.Forbidden, discord.NotFound):
+                break
+            except discord.HTTPException as e:
+                if e.status == 400:
+                    return None
+                if e.status < 500:
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            else:
+                metrics["sent"] += len(embeds)
+                return True
+        return False
+
+    async def deliver(self, channel: discord.TextChannel, embeds: list):
+        """Envoie des logs en les regroupant, un par un si Discord refuse le regroupement"""
+        metrics = self.metrics.setdefault(channel.id, {"sent": 0, "dropped": 0, "failed": 0, "retries": 0})
+        failed = metrics["failed"]
+        for group in self.group_embeds(embeds):
+            result = await self.send_with_retry(channel, group)
+            if result:
+                continue
+            if result is None and len(group) > 1:
+                for em in group:
+                    if not await self.send_with_retry(channel, [em]):
+                        metrics["failed"] += 1
+            else:
+                metrics["failed"] += len(group)
+        if metrics["failed"] > failed:
+            logger.error(f"{metrics['failed'] - failed} logs n'ont pas pu être envoyés sur #{channel} ({channel.id})")
+
+    async def channel_worker(self, channel: discord.TextChannel, queue: asyncio.Queue):
+        """Envoie les logs d'un salon au fur et à mesure qu'ils arrivent dans sa file
+
+        Les logs arrivés pendant le délai du serveur (ou jusqu'à 10 logs) sont regroupés dans un même message, un délai
+        de 0 les envoie un par un. Le worker s'arrête après quelques minutes sans logs."""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                em, delay = await asyncio.wait_for(queue.get(), timeout=_WORKER_IDLE)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self.queues.pop(channel.id, None)
+                    self.workers.pop(channel.id, None)
+                    return
+                continue
+            embeds = [em]
+            deadline = loop.time() + delay
+            while delay > 0 and len(embeds) < _MAX_EMBEDS:
+                if queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        em, _ = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    em, _ = queue.get_nowait()
+                embeds.append(em)
+            try:
+                await self.deliver(channel, embeds)
+            except Exception:
+                logger.error(f"Erreur lors de l'envoi des logs sur #{channel} ({channel.id})", exc_info=True)
+
+    def queue_embed(self, channel: discord.TextChannel, embed: discord.Embed, delay: float) -> bool:
+        """Ajoute un log à la file du salon sans attendre son envoi
+
+        Renvoie False si la file est pleine, le log est alors abandonné"""
+        if channel.id not in self.queues:
+            queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+            self.queues[channel.id] = (channel, queue)
+            self.workers[channel.id] = asyncio.create_task(self.channel_worker(channel, queue))
+        queue = self.queues[channel.id][1]
+        try:
+            queue.put_nowait((embed, delay))
+        except asyncio.QueueFull:
+            self.metrics.setdefault(channel.id, {"sent": 0, "dropped": 0, "failed": 0, "retries": 0})["dropped"] += 1
+            return False
+        return True
+
+    def _archive(self):
+        """Renvoie la connexion à l'archive des évènements (uniquement depuis archive_pool)"""
+        if not self.archive_db:
+            self.archive_db = sqlite3.connect(str(cog_data_path(self) / "archive.db"))
+            self.archive_db.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS events (
+                    guild_id INTEGER NOT NULL,
+                    ts REAL NOT NULL,
+                    trigger TEXT NOT NULL,
+                    user_id INTEGER,
+                    user_name TEXT,
+                    content TEXT);
+                CREATE INDEX IF NOT EXISTS events_user ON events (guild_id, user_id, ts);
+                CREATE INDEX IF NOT EXISTS events_trigger ON events (guild_id, trigger, ts);
+                CREATE INDEX IF NOT EXISTS events_ts ON events (guild_id, ts);
+                CREATE INDEX IF NOT EXISTS events_prune ON events (ts);""")
+        return self.archive_db
+
+    def _write_archive(self, rows: list):
+        db = self._archive()
+        with db:
+            db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _prune_archive(self, before: float):
+        db = self._archive()
+        with db:
+            db.execute("DELETE FROM events WHERE ts < ?", (before,))
+
+    def _close_archive(self):
+        if self.archive_db:
+            self.archive_db.close()
+            self.archive_db = None
+
+    def _search_archive(self, guild_id: int, trigger: str, user_id: int, since: float):
+        query, params = "FROM events WHERE guild_id = ? AND ts >= ?", [guild_id, since]
+        if trigger:
+            query += " AND trigger LIKE ?"
+            params.append(trigger.replace("*", "%"))
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        db = self._archive()
+        total = db.execute("SELECT COUNT(*) " + query, params).fetchone()[0]
+        rows = db.execute("SELECT ts, trigger, user_id, user_name, content " + query + " ORDER BY ts DESC LIMIT ?",
+                          params + [_SEARCH_LIMIT]).fetchall()
+        return total, rows
+
+    async def flush_archive(self):
+        """Écrit dans l'archive les évènements en attente (dans le thread de l'archive)"""
+        rows, self.archive_rows = self.archive_rows, []
+        if rows:
+            try:
+                await self.bot.loop.run_in_executor(self.archive_pool, self._write_archive, rows)
+            except Exception:
+                logger.error(f"{len(rows)} évènements n'ont pas pu être archivés", exc_info=True)
+
+    def archive_event(self, guild: discord.Guild, trigger: str, content: discord.Embed, user=None):
+        """Ajoute un évènement aux écritures en attente de l'archive"""
+        text = [content.description] if content.description else []
+        text += [f"{field.name} : {field.value}" for field in content.fields]
+        name = str(user) if user and not isinstance(user, discord.Object) else None
+        self.archive_rows.append((guild.id, time.time(), trigger, user.id if user else None, name, "\n".join(text)))
+        if len(self.archive_rows) >= _ARCHIVE_BATCH:
+            asyncio.create_task(self.flush_archive())
+
+    async def manage_logging(self, guild: discord.Guild, trigger: str, content: discord.Embed, *, user=None):
+        """Gère l'envoi des logs sur les channels liés du serveur
+
+        Les logs sont ajoutés à la file de chaque salon lié et envoyés par le worker du salon (voir channel_worker()).
+        Ils sont aussi enregistrés dans l'archive consultable avec `;logs search`, avec le membre concerné s'il est donné."""
+        profile = await self.get_profile(guild)
+        trigger = trigger.lower()
+        if trigger in profile["channels"]:
+            self.archive_event(guild, trigger, content, user)
+            colour = profile["colors"].get(trigger) or profile["default_color"]
+            queued = False
+            for chan in profile["channels"][trigger]:
+                em = content.copy()
+                em.colour = colour
+                queued = self.queue_embed(chan, em, profile["delay"]) or queued
+            return queued
         return None
 
     async def global_logging(self, trigger: str, content: discord.Embed):
-        """Envoie sur tous les serveurs avec le trigger activé"""
-        all_guilds = self.bot.guilds
-        traceback = []
-        for guild in all_guilds:
-            preload = await self.get_preloaded_channels(guild)
-            if preload.get(trigger.lower(), False):
+        """Envoie sur tous les serveurs avec le trigger activé
+
+        Les serveurs abonnés sont traités en parallèle (dans la limite réglée avec `;logs concurrency`).
+        Renvoie une liste de (ID du serveur, résultat, durée en secondes)"""
+        async def log(guild):
+            async with self.concurrency:
+                start = time.perf_counter()
                 try:
                     result = await self.manage_logging(guild, trigger, content)
-                    traceback.append((guild.id, result))
-                except:
-                    pass
-        return traceback
+                except Exception:
+                    logger.error(f"Le log global {trigger} n'a pas pu être traité sur {guild.id}", exc_info=True)
+                    result = None
+                return guild.id, result, time.perf_counter() - start
+
+        guilds = [self.bot.get_guild(guild_id) for guild_id in list(self.subscribers.get(trigger.lower(), ()))]
+        return await asyncio.gather(*[log(guild) for guild in guilds if guild])
 
     @commands.group(name="logs")
     @commands.guild_only()
@@ -139,10 +569,125 @@ class Logs(commands.Cog):
             elif trigger in perso:
                 del perso[trigger]
             await self.config.guild(ctx.guild).colors.set(perso)
+            await self.load_profile(ctx.guild)
             await ctx.send(embed=em)
         else:
             await ctx.send(f"**Erreur** • Ce nom de trigger n'existe pas. Consultez la liste avec `;logs list`.")
 
+    @_logs.command(name="delay")
+    async def flush_delay(self, ctx, secondes: float = 1.5):
+        """Modifie le délai pendant lequel les logs d'un même salon sont regroupés en un seul message
+
+        Un délai plus long réduit le nombre de messages envoyés lors d'un raid ou d'une purge, 0 désactive le regroupement.
+        Par défaut 1.5s"""
+        if not 0 <= secondes <= 10:
+            return await ctx.send("**Erreur** • Le délai doit être compris entre 0 et 10 secondes.")
+        await self.config.guild(ctx.guild).delay.set(secondes)
+        await self.load_profile(ctx.guild)
+        if secondes:
+            await ctx.send(f"**Délai modifié** • Les logs d'un même salon seront regroupés pendant {secondes}s.")
+        else:
+            await ctx.send("**Délai retiré** • Les logs seront envoyés un par un, sans être regroupés.")
+
+    @_logs.command(name="search")
+    async def search_archive(self, ctx, trigger: str = "*", membre: Optional[Union[discord.Member, discord.User]] = None,
+                             jours: int = 7):
+        """Recherche dans l'archive des logs du serveur
+
+        <trigger> accepte `*` comme joker (ex. `message.*`, `*` pour tous les triggers)
+        [membre] peut être une mention ou un ID (y compris d'un membre qui a quitté le serveur), il peut être omis
+        [jours] limite la recherche aux derniers jours (par défaut 7, ex. `;logs search message.delete 30`)"""
+        em_color = await ctx.embed_color()
+        user_id = membre.id if membre else None
+        since = time.time() - max(1, jours) * 86400
+        await self.flush_archive()
+        total, rows = await self.bot.loop.run_in_executor(self.archive_pool, self._search_archive, ctx.guild.id,
+                                                          trigger.lower() if trigger != "*" else None, user_id, since)
+        if not rows:
+            return await ctx.send("**Aucun résultat** • Aucun évènement archivé ne correspond à cette recherche.")
+        pages = []
+        for n in range(0, len(rows), 10):
+            em = discord.Embed(color=em_color)
+            for ts, trig, uid, name, content in rows[n:n + 10]:
+                date = datetime.fromtimestamp(ts).strftime("%d/%m/%Y %H:%M")
+                value = (content or "—")[:300]
+                em.add_field(name=f"{date} · {trig} · {name or uid or 'Inconnu'}", value=value, inline=False)
+            em.set_author(name=f"Archive des logs » {trigger}", icon_url=self.bot.user.avatar_url)
+            footer = f"Page {n // 10 + 1}/{(len(rows) - 1) // 10 + 1} · {total} résultats"
+            if total > len(rows):
+                footer += f" ({len(rows)} plus récents affichés)"
+            em.set_footer(text=footer)
+            pages.append(em)
+        await menu(ctx, pages, DEFAULT_CONTROLS)
+
+    @_logs.command(name="memory")
+    async def cache_memory(self, ctx):
+        """Affiche la mémoire utilisée par le cache des messages (pour logger les suppressions et éditions)"""
+        em_color = await ctx.embed_color()
+        rings = [(channel, self.message_cache[channel.id]) for channel in ctx.guild.text_channels
+                 if self.message_cache.get(channel.id)]
+        rings.sort(key=lambda item: item[1].bytes, reverse=True)
+        table = [[f"#{channel.name}"[:20], len(ring), self.humanize_size(ring.bytes)] for channel, ring in rings[:15]]
+        total = sum(ring.bytes for ring in self.message_cache.values())
+        count = sum(len(ring) for ring in self.message_cache.values())
+        if table:
+            desc = "```" + tabulate(table, headers=["Salon", "Messages", "Mémoire"]) + "```"
+        elif self.cache_enabled(ctx.guild.id):
+            desc = "Aucun message n'est encore en cache sur ce serveur."
+        else:
+            desc = "Le cache est désactivé sur ce serveur : aucun salon n'est lié à `message.delete` ou `message.edit`."
+        em = discord.Embed(color=em_color, description=desc)
+        em.set_author(name="Cache des messages", icon_url=self.bot.user.avatar_url)
+        em.set_footer(text=f"Tous serveurs : {count} messages · {self.humanize_size(total)} "
+                           f"(max. {self.humanize_size(_CACHE_CHANNEL_BYTES)} par salon)")
+        await ctx.send(embed=em)
+
+    @_logs.command(name="concurrency")
+    @checks.is_owner()
+    async def global_concurrency(self, ctx, limite: int):
+        """Modifie le nombre de serveurs traités en même temps lors de l'envoi d'un log global (par défaut 25)"""
+        if not 1 <= limite <= 500:
+            return await ctx.send("**Erreur** • La limite doit être comprise entre 1 et 500.")
+        await self.config.concurrency.set(limite)
+        self.concurrency = asyncio.Semaphore(limite)
+        await ctx.send(f"**Limite modifiée** • Les logs globaux seront traités sur {limite} serveurs à la fois.")
+
+    @_logs.command(name="stats")
+    async def queue_stats(self, ctx):
+        """Affiche les statistiques d'envoi des logs des salons du serveur"""
+        em_color = await ctx.embed_color()
+        table = []
+        for channel in ctx.guild.text_channels:
+            metrics = self.metrics.get(channel.id)
+            if metrics:
+                waiting = self.queues[channel.id][1].qsize() if channel.id in self.queues else 0
+                table.append([f"#{channel.name}"[:20], metrics["sent"], waiting, metrics["dropped"], metrics["failed"],
+                              metrics["retries"]])
+        if table:
+            desc = "```" + tabulate(table, headers=["Salon", "Envoyés", "En attente", "Abandonnés", "Échecs", "Relances"]) + "```"
+            em = discord.Embed(color=em_color, description=desc)
+            em.set_author(name="Statistiques d'envoi des logs", icon_url=self.bot.user.avatar_url)
+            em.set_footer(text="Depuis le dernier démarrage du module")
+            await ctx.send(embed=em)
+        else:
+            await ctx.send("**Aucune donnée** • Aucun log n'a été envoyé sur ce serveur depuis le démarrage du module.")
+
+    @_logs.command(name="raid")
+    async def raid_threshold(self, ctx, seuil: int = 8):
+        """Modifie le nombre d'arrivées (ou de départs) en 10s à partir duquel ils sont regroupés en résumés
+
+        Tant que le rythme reste élevé, un résumé listant les membres concernés est envoyé toutes les 15s au lieu
+        d'un log par membre. 0 désactive les résumés. Par défaut 8"""
+        if not 0 <= seuil <= 100:
+            return await ctx.send("**Erreur** • Le seuil doit être compris entre 0 et 100.")
+        await self.config.guild(ctx.guild).raid_threshold.set(seuil)
+        await self.load_profile(ctx.guild)
+        if seuil:
+            await ctx.send(f"**Seuil modifié** • À partir de {seuil} arrivées ou départs en 10s, "
+                           f"ils seront regroupés en résumés.")
+        else:
+            await ctx.send("**Résumés désactivés** • Chaque arrivée et départ sera toujours loggé individuellement.")
+
     @_logs.command(name="list")
     async def list_triggers(self, ctx):
         """Liste les nom de triggers acceptés"""
@@ -240,70 +785,99 @@ class Logs(commands.Cog):
                 f"Il n'y a aucun trigger de logs lié au salon {salon.mention}")
 
 
+    def cache_enabled(self, guild_id: int) -> bool:
+        return guild_id in self.subscribers.get("message.delete", ()) or \
+               guild_id in self.subscribers.get("message.edit", ())
+
+    def resolve_author(self, guild: discord.Guild, user_id: int):
+        return guild.get_member(user_id) or self.bot.get_user(user_id) or discord.Object(id=user_id)
+
+    async def log_deleted(self, guild: discord.Guild, record: CachedMessage):
+        author = self.resolve_author(guild, record.author_id)
+        channel = guild.get_channel(record.channel_id)
+        em = discord.Embed(description=record.content, timestamp=datetime.utcnow())
+        if record.attachments:
+            em.add_field(name="Pièces jointes", value="\n".join(record.attachments)[:1024])
+        if isinstance(author, discord.Object):
+            em.set_author(name=f"{record.author_id} » Message supprimé")
+        else:
+            em.set_author(name=str(author) + " » Message supprimé", icon_url=author.avatar_url)
+        em.set_footer(text=f"{record.author_id} · #{channel.name if channel else record.channel_id}")
+        await self.manage_logging(guild, "message.delete", em, user=author)
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        delay = self.delays["discord_status"]
-        if delay + 300 < time.time():
-            self.delays["discord_status"] = time.time()
-            statuspage = requests.get("https://srhpyqt94yxb.statuspage.io/api/v2/status.json")
-            status = statuspage.json()["status"]["indicator"]
-            page = statuspage.json()["page"]["url"]
-            ts = datetime.utcnow()
-            if status != "none":
-                if self.delays["status_cd"] <= time.time():
-                    self.delays["status_cd"] = time.time() + 3600
-                    if not self.delays["status_mode"]:
-                        self.delays["status_mode"] = True
-                        em = discord.Embed(description=f"Les serveurs de Discord connaissent actuellement des instabilités.\n"
-                                                       f"Consultez {page} pour plus d'infos.", timestamp=ts)
-                        em.set_author(name="Instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
-                        em.set_footer(text=f"Message global")
-                    else:
-                        em = discord.Embed(
-                            description=f"Les perturbations sur les serveurs Discord se poursuivent.\n"
-                                        f"Consultez {page} pour plus d'infos.", timestamp=ts)
-                        em.set_author(name="Instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
-                        em.set_footer(text=f"Message global")
-                    await self.global_logging("discord.status", em)
-                else:
-                    pass
-            elif self.delays["status_mode"]:
-                self.delays["status_mode"] = False
-                em = discord.Embed(description=f"Les perturbations des serveurs Discord semblent avoir été résolus.\n"
-                                               f"Consultez {page} pour plus d'infos.", timestamp=ts)
-                em.set_author(name="Fin des instabilité des serveurs Discord", icon_url=self.bot.user.avatar_url)
-                em.set_footer(text=f"Message global")
-                await self.global_logging("discord.status", em)
+        if message.guild and self.cache_enabled(message.guild.id):
+            ring = self.message_cache.get(message.channel.id)
+            if ring is None:
+                ring = self.message_cache[message.channel.id] = MessageRing()
+            ring.add(CachedMessage(message))
 
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        if not payload.guild_id:
+            return
+        ring = self.message_cache.get(payload.channel_id)
+        record = ring.pop(payload.message_id) if ring else None
+        if payload.cached_message:
+            record = CachedMessage(payload.cached_message)
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild and record and record.author_id != self.bot.user.id:
+            preload = await self.get_preloaded_channels(guild)
+            if preload.get("message.delete", False):
+                await self.log_deleted(guild, record)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message):
-        if message.guild:
-            if message.author:
-                if message.author != self.bot.user:
-                    preload = await self.get_preloaded_channels(message.guild)
-                    ts = datetime.utcnow()
-                    if preload.get("message.delete", False):
-                        em = discord.Embed(description=message.content, timestamp=ts)
-                        em.set_author(name=str(message.author) + " » Message supprimé", icon_url=message.author.avatar_url)
-                        em.set_footer(text=f"{message.author.id} · #{message.channel.name}")
-                        await self.manage_logging(message.guild, "message.delete", em)
+    async def on_raw_bulk_message_delete(self, payload):
+        if not payload.guild_id:
+            return
+        ring = self.message_cache.get(payload.channel_id)
+        records = {}
+        for message_id in payload.message_ids:
+            record = ring.pop(message_id) if ring else None
+            if record:
+                records[message_id] = record
+        for message in payload.cached_messages:
+            records[message.id] = CachedMessage(message)
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild and records:
+            preload = await self.get_preloaded_channels(guild)
+            if preload.get("message.delete", False):
+                for message_id in sorted(records):
+                    if records[message_id].author_id != self.bot.user.id:
+                        await self.log_deleted(guild, records[message_id])
 
     @commands.Cog.listener()
-    async def on_message_edit(self, before, after):
-        if after.guild:
-            if after.author:
-                if after.author != self.bot.user:
-                    if after.content != before.content:
-                        preload = await self.get_preloaded_channels(after.guild)
-                        if preload.get("message.edit", False):
-                            em = discord.Embed(timestamp=after.created_at)
-                            em.add_field(name="Avant", value=before.content)
-                            em.add_field(name="Après", value=after.content)
-                            em.set_author(name=str(after.author) + " » Message édité",
-                                          icon_url=after.author.avatar_url, url=after.jump_url)
-                            em.set_footer(text=f"{after.author.id} · #{after.channel.name}")
-                            await self.manage_logging(after.guild, "message.edit", em)
+    async def on_raw_message_edit(self, payload):
+        content = payload.data.get("content")
+        guild_id = payload.data.get("guild_id")
+        if content is None or not guild_id:
+            return
+        ring = self.message_cache.get(payload.channel_id)
+        record = ring.get(payload.message_id) if ring else None
+        if payload.cached_message:
+            record = CachedMessage(payload.cached_message)
+        if not record or record.content == content or record.author_id == self.bot.user.id:
+            return
+        before = record.content
+        if ring:
+            ring.update(payload.message_id, content)
+        guild = self.bot.get_guild(int(guild_id))
+        if guild:
+            preload = await self.get_preloaded_channels(guild)
+            if preload.get("message.edit", False):
+                author = self.resolve_author(guild, record.author_id)
+                channel = guild.get_channel(payload.channel_id)
+                url = f"https://discord.com/channels/{guild.id}/{payload.channel_id}/{payload.message_id}"
+                em = discord.Embed(timestamp=discord.utils.snowflake_time(payload.message_id))
+                em.add_field(name="Avant", value=before[:1024] or "—")
+                em.add_field(name="Après", value=content[:1024] or "—")
+                if isinstance(author, discord.Object):
+                    em.set_author(name=f"{record.author_id} » Message édité", url=url)
+                else:
+                    em.set_author(name=str(author) + " » Message édité", icon_url=author.avatar_url, url=url)
+                em.set_footer(text=f"{record.author_id} · #{channel.name if channel else payload.channel_id}")
+                await self.manage_logging(guild, "message.edit", em, user=author)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, user, before, after):
@@ -319,7 +893,7 @@ class Logs(commands.Cog):
                         em.set_author(name=str(user) + " » Connexion à un salon vocal",
                                       icon_url=user.avatar_url)
                         em.set_footer(text=f"{user.id} · #{after.channel.name}")
-                        await self.manage_logging(user.guild, "voice.join", em)
+                        await self.manage_logging(user.guild, "voice.join", em, user=user)
                 elif after.channel != before.channel:
                     if preload.get("voice.update", False):
                         em = discord.Embed(description=f"{user.mention} est passé de {before.channel.mention} à {after.channel.mention}",
@@ -327,7 +901,7 @@ class Logs(commands.Cog):
                         em.set_author(name=str(user) + " » Changement de salon",
                                       icon_url=user.avatar_url)
                         em.set_footer(text=f"{user.id} · #{before.channel.name} / #{after.channel.name}")
-                        await self.manage_logging(user.guild, "voice.update", em)
+                        await self.manage_logging(user.guild, "voice.update", em, user=user)
 
             elif before.channel:
                 if preload.get("voice.quit", False):
@@ -336,7 +910,7 @@ class Logs(commands.Cog):
                     em.set_author(name=str(user) + " » Déconnexion d'un salon vocal",
                                   icon_url=user.avatar_url)
                     em.set_footer(text=f"{user.id} · #{before.channel.name}")
-                    await self.manage_logging(user.guild, "voice.quit", em)
+                    await self.manage_logging(user.guild, "voice.quit", em, user=user)
 
             if before.channel and after.channel: # Déjà en vocal
                 title = desc = type = None
@@ -405,7 +979,7 @@ class Logs(commands.Cog):
                         em = discord.Embed(description=desc, timestamp=ts)
                         em.set_author(name=str(user) + f" » {title}", icon_url=user.avatar_url)
                         em.set_footer(text=f"{user.id} · #{after.channel.name}")
-                        await self.manage_logging(user.guild, type, em)
+                        await self.manage_logging(user.guild, type, em, user=user)
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
@@ -422,7 +996,7 @@ class Logs(commands.Cog):
                     em.set_author(name=str(after) + " » Changement de surnom",
                                   icon_url=after.avatar_url)
                     em.set_footer(text=f"{after.id}")
-                    await self.manage_logging(after.guild, "member.update.nick", em)
+                    await self.manage_logging(after.guild, "member.update.nick", em, user=after)
 
     @commands.Cog.listener()
     async def on_user_update(self, before, after):
@@ -436,7 +1010,7 @@ class Logs(commands.Cog):
                     em.set_author(name=str(after) + " » Changement de pseudonyme",
                                   icon_url=after.avatar_url)
                     em.set_footer(text=f"{after.id}")
-                    await self.manage_logging(after.guild, "member.update.name", em)
+                    await self.manage_logging(after.guild, "member.update.name", em, user=after)
             if after.avatar_url != before.avatar_url:
                 url = before.avatar_url.split("?")[0]
                 if preload.get("member.update.avatar", False):
@@ -447,18 +1021,90 @@ class Logs(commands.Cog):
                                   icon_url=after.avatar_url)
                     em.set_thumbnail(url=url)
                     em.set_footer(text=f"{after.id}")
-                    await self.manage_logging(after.guild, "member.update.avatar", em)
+                    await self.manage_logging(after.guild, "member.update.avatar", em, user=after)
+
+    def raid_mode(self, guild: discord.Guild, kind: str, threshold: int) -> bool:
+        """Mesure le rythme des arrivées (ou départs) et renvoie True s'ils doivent être regroupés en résumés
+
+        Le mode résumé commence dès que `threshold` évènements ont lieu en moins de 10 secondes, et se termine tout
+        seul lorsque le rythme redescend (voir digest_worker())"""
+        now = time.monotonic()
+        window = self.rates.setdefault((guild.id, kind), deque())
+        window.append(now)
+        while window[0] < now - _RAID_WINDOW:
+            window.popleft()
+        if (guild.id, kind) in self.digests:
+            return True
+        if threshold and len(window) >= threshold:
+            self.digests[(guild.id, kind)] = {"members": [], "task": asyncio.create_task(self.digest_worker(guild, kind))}
+            return True
+        return False
+
+    async def digest_trigger(self, guild: discord.Guild, kind: str) -> str:
+        """Trigger sur lequel envoyer les résumés (les infos des arrivants si seul ce trigger est lié)"""
+        profile = await self.get_profile(guild)
+        return kind if kind in profile["channels"] else "member.join.infos"
+
+    async def send_digest(self, guild: discord.Guild, kind: str, lines: list):
+        trigger = await self.digest_trigger(guild, kind)
+        for n in range(0, len(lines), _DIGEST_SIZE):
+            chunk = lines[n:n + _DIGEST_SIZE]
+            em = discord.Embed(description="\n".join(chunk), timestamp=datetime.utcnow())
+            if kind == "member.join":
+                em.set_author(name=f"Afflux d'arrivées » {len(chunk)} nouveaux membres", icon_url=self.bot.user.avatar_url)
+            else:
+                em.set_author(name=f"Vague de départs » {len(chunk)} membres partis", icon_url=self.bot.user.avatar_url)
+            em.set_footer(text="Mode raid · regroupement automatique tant que le rythme reste élevé")
+            await self.manage_logging(guild, trigger, em)
+
+    async def digest_worker(self, guild: discord.Guild, kind: str):
+        """Envoie régulièrement les résumés d'un serveur en mode raid et quitte ce mode lorsque le rythme redescend"""
+        key = (guild.id, kind)
+        total = 0
+        try:
+            while True:
+                await asyncio.sleep(_DIGEST_DELAY)
+                digest = self.digests[key]
+                lines, digest["members"] = digest["members"], []
+                if lines:
+                    total += len(lines)
+                    await self.send_digest(guild, kind, lines)
+                window = self.rates.get(key, deque())
+                while window and window[0] < time.monotonic() - _RAID_WINDOW:
+                    window.popleft()
+                threshold = (await self.get_profile(guild))["raid_threshold"]
+                if len(window) < max(threshold, 1) and not digest["members"]:
+                    break
+        finally:
+            self.digests.pop(key, None)
+        if kind == "member.join":
+            desc = f"Le rythme des arrivées est redescendu, les logs reprennent normalement.\n" \
+                   f"**{total}** arrivées ont été regroupées pendant ce mode."
+        else:
+            desc = f"Le rythme des départs est redescendu, les logs reprennent normalement.\n" \
+                   f"**{total}** départs ont été regroupés pendant ce mode."
+        em = discord.Embed(description=desc, timestamp=datetime.utcnow())
+        em.set_author(name="Fin du mode raid", icon_url=self.bot.user.avatar_url)
+        await self.manage_logging(guild, await self.digest_trigger(guild, kind), em)
 
     @commands.Cog.listener()
     async def on_member_join(self, user):
-        preload = await self.get_preloaded_channels(user.guild)
+        profile = await self.get_profile(user.guild)
+        preload = profile["channels"]
         ts = datetime.utcnow()
+        if preload.get("member.join", False) or preload.get("member.join.infos", False):
+            if self.raid_mode(user.guild, "member.join", profile["raid_threshold"]):
+                created_since = (datetime.utcnow() - user.created_at).days
+                self.digests[(user.guild.id, "member.join")]["members"].append(
+                    f"{user.mention} · `{user.id}` · compte créé il y a **{created_since}**j")
+                return
+
         if preload.get("member.join", False):
             em = discord.Embed(description=f"{user.mention} a rejoint le serveur", timestamp=ts)
             em.set_author(name=str(user) + " » Nouvel arrivant",
                           icon_url=user.avatar_url)
             em.set_footer(text=f"{user.id}")
-            await self.manage_logging(user.guild, "member.join", em)
+            await self.manage_logging(user.guild, "member.join", em, user=user)
 
         if preload.get("member.join.infos", False):
             userinfo = None
@@ -485,18 +1131,21 @@ class Logs(commands.Cog):
                           icon_url=user.avatar_url)
             em.set_thumbnail(url=user.avatar_url)
             em.set_footer(text=f"{user.id}")
-            await self.manage_logging(user.guild, "member.join.infos", em)
+            await self.manage_logging(user.guild, "member.join.infos", em, user=user)
 
     @commands.Cog.listener()
     async def on_member_remove(self, user):
-        preload = await self.get_preloaded_channels(user.guild)
-        if preload.get("member.quit", False):
+        profile = await self.get_profile(user.guild)
+        if profile["channels"].get("member.quit", False):
+            if self.raid_mode(user.guild, "member.quit", profile["raid_threshold"]):
+                self.digests[(user.guild.id, "member.quit")]["members"].append(f"***{user.name}*** · `{user.id}`")
+                return
             ts = datetime.utcnow()
             em = discord.Embed(description=f"***{user.name}*** a quitté le serveur", timestamp=ts)
             em.set_author(name=str(user) + " » Départ du membre",
                           icon_url=user.avatar_url)
             em.set_footer(text=f"{user.id}")
-            await self.manage_logging(user.guild, "member.quit", em)
+            await self.manage_logging(user.guild, "member.quit", em, user=user)
 
     @commands.Cog.listener()
     async def on_member_ban(self, user):
@@ -507,7 +1156,7 @@ class Logs(commands.Cog):
             em.set_author(name=str(user) + " » Bannissement",
                           icon_url=user.avatar_url)
             em.set_footer(text=f"{user.id}")
-            await self.manage_logging(user.guild, "member.ban", em)
+            await self.manage_logging(user.guild, "member.ban", em, user=user)
 
     @commands.Cog.listener()
     async def on_member_unban(self, user):
@@ -518,7 +1167,7 @@ class Logs(commands.Cog):
             em.set_author(name=str(user) + " » Débannissement",
                           icon_url=user.avatar_url)
             em.set_footer(text=f"{user.id}")
-            await self.manage_logging(user.guild, "member.unban", em)
+            await self.manage_logging(user.guild, "member.unban", em, user=user)
 
     @commands.Cog.listener()
     async def on_invite_create(self, invite):
@@ -529,7 +1178,7 @@ class Logs(commands.Cog):
                                timestamp=ts)
             em.set_author(name="Création d'une invitation", icon_url=self.bot.user.avatar_url)
             em.set_footer(text=f"{invite.inviter.id}")
-            await self.manage_logging(invite.guild, "invite.create", em)
+            await self.manage_logging(invite.guild, "invite.create", em, user=invite.inviter)
 
     @commands.Cog.listener()
     async def on_invite_delete(self, invite):
@@ -540,7 +1189,27 @@ class Logs(commands.Cog):
                                timestamp=ts)
             em.set_author(name="Suppression d'une invitation", icon_url=self.bot.user.avatar_url)
             em.set_footer(text=f"{invite.inviter.id}")
-            await self.manage_logging(invite.guild, "invite.delete", em)
+            await self.manage_logging(invite.guild, "invite.delete", em, user=invite.inviter)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.message_cache.pop(channel.id, None)
+        profile = self.profiles.get(channel.guild.id)
+        if profile and any(channel in chans for chans in profile["channels"].values()):
+            await self.load_profile(channel.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        profile = self.profiles.get(after.guild.id)
+        if profile and any(after.id in [chan.id for chan in chans] for chans in profile["channels"].values()):
+            await self.load_profile(after.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        for channel in guild.channels:
+            self.message_cache.pop(channel.id, None)
+        self.profiles.pop(guild.id, None)
+        self.update_subscriptions(guild.id, {})
 
     @commands.Cog.listener()
     async def on_guild_unavailable(self, guild):
@@ -1,4 +1,6 @@
 from .pixel import Pixel
 
-def setup(bot):
-    bot.add_cog(Pixel(bot))
\ No newline at end of file
+async def setup(bot):
+    cog = Pixel(bot)
+    await cog.initialize()
+    bot.add_cog(cog)
\ No newline at end of file
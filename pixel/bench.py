@@ -0,0 +1,407 @@
+"""Benchmark de Pixel sur une charge synthétique
+
+Construit un faux serveur avec plusieurs milliers de fichiers, puis mesure le coût des messages contenant des
+`:noms:` (Pixel.on_message) et de la commande `pix add` : débit, latences p50/p99 et nombre de lectures et
+d'écritures Config par message. Discord et Config sont remplacés par des objets locaux, aucun réseau n'est utilisé.
+
+Utilisation (depuis la racine du dépôt, dans l'environnement de Red) :
+    python -m pixel.bench [--stickers 10000] [--messages 5000] [--adds 200] [--seed 0]"""
+
+import argparse
+import asyncio
+import copy
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from . import pixel as pixel_module
+
+
+class Stats:
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.sends = 0
+
+    def reset(self):
+        self.reads = self.writes = self.sends = 0
+
+
+class FakeValue:
+    """Remplace une valeur (ou un groupe) de Config et compte les lectures et écritures"""
+
+    def __init__(self, store: dict, path: list, stats: Stats):
+        self.store = store
+        self.path = path
+        self.stats = stats
+
+    def _node(self):
+        node = self.store
+        for key in self.path:
+            node = node[key]
+        return node
+
+    def __getattr__(self, item):
+        return FakeValue(self.store, self.path + [item], self.stats)
+
+    def __call__(self):
+        return FakeValueContext(self)
+
+    async def _get(self):
+        self.stats.reads += 1
+        return copy.deepcopy(self._node())
+
+    async def get_raw(self, *keys):
+        self.stats.reads += 1
+        node = self._node()
+        for key in keys:
+            node = node[str(key)]
+        return copy.deepcopy(node)
+
+    async def set(self, value):
+        self.stats.writes += 1
+        parent = self.store
+        for key in self.path[:-1]:
+            parent = parent[key]
+        parent[self.path[-1]] = copy.deepcopy(value)
+
+    async def set_raw(self, *keys, value):
+        self.stats.writes += 1
+        node = self._node()
+        for key in keys[:-1]:
+            node = node.setdefault(str(key), {})
+        node[str(keys[-1])] = copy.deepcopy(value)
+
+    async def clear_raw(self, *keys):
+        self.stats.writes += 1
+        node = self._node()
+        for key in keys[:-1]:
+            node = node[str(key)]
+        node.pop(str(keys[-1]), None)
+
+    async def clear(self):
+        self.stats.writes += 1
+        parent = self.store
+        for key in self.path[:-1]:
+            parent = parent[key]
+        parent.pop(self.path[-1], None)
+
+    def get_lock(self):
+        return asyncio.Lock()
+
+
+class FakeValueContext:
+    """Comme dans Red, `await value()` lit la valeur et `async with value() as v` la réécrit en sortie"""
+
+    def __init__(self, value: FakeValue):
+        self.value = value
+        self.data = self.original = None
+
+    def __await__(self):
+        return self.value._get().__await__()
+
+    async def __aenter__(self):
+        self.data = await self.value._get()
+        self.original = copy.deepcopy(self.data)
+        return self.data
+
+    async def __aexit__(self, *args):
+        if self.data != self.original:
+            await self.value.set(self.data)
+        return False
+
+
+class FakeConfig:
+    def __init__(self, stats: Stats):
+        self.stats = stats
+        self.globals = {}
+        self.guilds = {}
+        self.guild_defaults = {}
+
+    def register_global(self, **defaults):
+        self.globals.update(copy.deepcopy(defaults))
+
+    def register_guild(self, **defaults):
+        self.guild_defaults.update(copy.deepcopy(defaults))
+
+    def guild_from_id(self, guild_id: int):
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = copy.deepcopy(self.guild_defaults)
+        return FakeValue(self.guilds[guild_id], [], self.stats)
+
+    def guild(self, guild):
+        return self.guild_from_id(guild.id)
+
+    async def all_guilds(self):
+        self.stats.reads += 1
+        return copy.deepcopy(self.guilds)
+
+    def __getattr__(self, item):
+        return FakeValue(self.globals, [item], self.stats)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.data = data
+        self.size = len(data)
+        self.url = f"https://cdn.example.invalid/{filename}"
+
+    async def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+
+class FakeMessage:
+    def __init__(self, content: str, guild, channel, author, attachments: list = None):
+        self.id = random.getrandbits(48)
+        self.content = content
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.attachments = attachments or []
+
+    async def delete(self):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild, stats: Stats):
+        self.id = channel_id
+        self.guild = guild
+        self.stats = stats
+
+    async def send(self, content=None, **kwargs):
+        self.stats.sends += 1
+        attachments = []
+        for file in kwargs.get("files") or []:
+            attachments.append(FakeAttachment(file.filename, b""))
+            file.close()
+        msg = FakeMessage(content or "", self.guild, self, None)
+        msg.attachments = attachments
+        return msg
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakePermissions:
+    administrator = True
+    manage_messages = True
+
+
+class FakeMember:
+    def __init__(self, member_id: int):
+        self.id = member_id
+        self.bot = False
+        self.mention = f"<@{member_id}>"
+
+    def permissions_in(self, channel):
+        return FakePermissions()
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "Benchmark"
+        self.emojis = []
+        self.filesize_limit = 8 * 1024 * 1024
+        self.members = {}
+
+    def get_member(self, member_id: int):
+        return self.members.setdefault(member_id, FakeMember(member_id))
+
+
+class FakeContext:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.guild = message.guild
+        self.channel = message.channel
+        self.author = message.author
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def embed_color(self):
+        return 0
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeResponse:
+    status = 200
+    headers = {"content-type": "image/png", "content-length": "2048"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession:
+    def head(self, url, **kwargs):
+        return FakeResponse()
+
+    async def close(self):
+        pass
+
+
+class FakeBot:
+    def __init__(self, guild):
+        self.loop = asyncio.get_event_loop()
+        self.guild = guild
+
+    def get_guild(self, guild_id: int):
+        return self.guild if guild_id == self.guild.id else None
+
+    async def get_embed_color(self, channel):
+        return 0
+
+    async def wait_until_ready(self):
+        pass
+
+
+def sticker_names(count: int, rng: random.Random) -> list:
+    """Génère des noms du type `chat`, `chat2`, `chat3`... comme ceux d'un vrai serveur"""
+    names, bases = [], set()
+    while len(names) < count:
+        base = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8)))
+        if base in bases:
+            continue
+        bases.add(base)
+        names.append(base)
+        for n in range(2, 2 + rng.choice([0, 0, 0, 1, 2, 4])):
+            names.append(f"{base}{n}")
+    return names[:count]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(title: str, timings: list, reads: list, writes: list, sends: list):
+    total = sum(timings)
+    count = len(timings)
+    print(f"{title}")
+    print(f"  {count} opérations en {total:.3f}s » {count / total:.0f}/s")
+    print(f"  latence p50 {percentile(timings, 50) * 1000:.3f}ms • p99 {percentile(timings, 99) * 1000:.3f}ms")
+    print(f"  Config par opération : {sum(reads) / count:.2f} lectures • {sum(writes) / count:.2f} écritures "
+          f"• {sum(sends) / count:.2f} envois Discord")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    stats = Stats()
+    data_path = Path(tempfile.mkdtemp(prefix="pixel-bench-"))
+    guild = FakeGuild(1)
+    channel = FakeChannel(10, guild, stats)
+    bot = FakeBot(guild)
+    with mock.patch.object(pixel_module, "cog_data_path", lambda *a, **k: data_path), \
+            mock.patch.object(pixel_module.Config, "get_conf", lambda *a, **k: FakeConfig(stats)):
+        cog = pixel_module.Pixel(bot)
+        cog.session = FakeSession()
+        try:
+            names = sticker_names(args.stickers, rng)
+            local = data_path / "files"
+            local.mkdir()
+            stickers = {}
+            for i, name in enumerate(names):
+                file = {"name": name, "path": None, "url": f"https://example.invalid/{name}.png", "author": 1,
+                        "creation": time.time(), "count": 0}
+                if i % 100 == 0: # 1% de fichiers stockés localement
+                    file["path"] = str(local / f"{name}.png")
+                    file["size"] = 1024
+                    with open(file["path"], "wb") as f:
+                        f.write(os.urandom(1024))
+                stickers[name] = file
+            await cog.config.guild(guild).STICKERS.set(stickers)
+            await cog.config.guild(guild).STORAGE.set(0)
+            await cog.get_index(guild)
+
+            def message_content():
+                kind = rng.random()
+                if kind < 0.45:
+                    return "regardez :{}:".format(rng.choice(names))
+                if kind < 0.6:
+                    return " ".join(":{}:".format(rng.choice(names)) for _ in range(rng.randint(2, 6)))
+                if kind < 0.75:
+                    return "{}:{}:".format(rng.choice(["b", "?", "e", "w", "!"]), rng.choice(names))
+                if kind < 0.85:
+                    return "rendez-vous à 12:30 ou 18:45 :inconnu:"
+                return "un message sans sticker"
+
+            timings, reads, writes, sends = [], [], [], []
+            for i in range(args.messages):
+                msg = FakeMessage(message_content(), guild, channel, guild.get_member(1000 + i))
+                stats.reset()
+                start = time.perf_counter()
+                await cog.on_message(msg)
+                timings.append(time.perf_counter() - start)
+                reads.append(stats.reads)
+                writes.append(stats.writes)
+                sends.append(stats.sends)
+            report(f"on_message ({args.stickers} fichiers, {args.messages} messages)", timings, reads, writes, sends)
+
+            stats.reset()
+            start = time.perf_counter()
+            await cog.flush_counters()
+            print(f"  sauvegarde des compteurs : {stats.writes} écritures en {time.perf_counter() - start:.3f}s")
+
+            timings, reads, writes, sends = [], [], [], []
+            for i in range(args.adds):
+                name = "benchadd" + "".join(rng.choice(string.ascii_lowercase) for _ in range(6))
+                if i % 2:
+                    msg = FakeMessage(f";pix add {name}", guild, channel, guild.get_member(1),
+                                      [FakeAttachment(f"{name}.png", os.urandom(2048))])
+                    url = None
+                else:
+                    msg = FakeMessage(f";pix add {name} https://example.invalid/{name}.png", guild, channel,
+                                      guild.get_member(1))
+                    url = f"https://example.invalid/{name}.png"
+                stats.reset()
+                start = time.perf_counter()
+                await cog.pixel_add.callback(cog, FakeContext(msg), name, url)
+                timings.append(time.perf_counter() - start)
+                reads.append(stats.reads)
+                writes.append(stats.writes)
+                sends.append(stats.sends)
+            report(f"pix add ({args.adds} ajouts, moitié URL / moitié fichier joint)", timings, reads, writes, sends)
+        finally:
+            if cog.pool:
+                cog.pool.shutdown(wait=False)
+            shutil.rmtree(str(data_path), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de Pixel sur une charge synthétique")
+    parser.add_argument("--stickers", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--adds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,34 @@
 import asyncio
+import bisect
+import hashlib
+import inspect
+import json
 import logging
 import operator
 import os
 import random
 import re
 import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from urllib.parse import urlsplit
 
 import aiofiles
 import aiohttp
 import discord
-import requests
 from redbot.core import Config, checks, commands
 from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import pagify
 from redbot.core.utils.menus import start_adding_reactions
 
+try:
+    from PIL import Image, ImageSequence
+except ImportError: # Optimisation des images désactivée
+    Image = ImageSequence = None
+
 logger = logging.getLogger("red.zaap-plugins.pixel")
 
 class PixelError(Exception):
@@ -33,6 +46,218 @@ class MaxFolderSize(PixelError):
 class DownloadError(PixelError):
     pass
 
+class InvalidArchive(PixelError):
+    pass
+
+_FLUSH_DELAY = 60 # Secondes entre deux sauvegardes des compteurs d'utilisation
+_PROBE_TTL = 300 # Secondes pendant lesquelles le résultat d'une requête HEAD est réutilisé
+_PROBE_FAIL_TTL = 10 # Secondes pendant lesquelles l'échec d'une requête HEAD est réutilisé
+_PROBE_CACHE_SIZE = 500
+_CHUNK_SIZE = 64 * 1024 # Taille des morceaux lus lors d'un téléchargement
+_GC_DELAY = 3600 # Secondes entre deux nettoyages des fichiers qui ne sont plus utilisés
+_CACHE_DELAY = 600 # Secondes entre deux mises à jour du cache des fichiers en ligne
+_CACHE_DOWNLOADS = 5 # Téléchargements maximum par serveur à chaque mise à jour du cache
+_SCAN_DELAY = 6 * 3600 # Secondes entre deux vérifications de l'intégrité du stockage local
+_SCAN_BATCH = 50 # Fichiers orphelins supprimés à la fois, avec une pause entre chaque lot
+_ORPHAN_AGE = 3600 # Secondes avant qu'un fichier non référencé soit considéré comme orphelin
+_BATCH_SIZE = 10 # Fichiers ou liens maximum par message envoyé
+_MAX_SESSIONS = 5 # Menus interactifs ouverts en même temps au maximum par serveur
+_MULTI_EMBEDS = "embeds" in inspect.signature(discord.abc.Messageable.send).parameters
+
+_EXTENSIONS = [".jpeg", ".jpg", ".png", ".gif", ".gifv", ".mp3", ".wav", ".mp4", ".webm", ".txt"]
+_MANIFEST = "manifest.json"
+
+_NAME_RE = re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE)
+
+def split_name(name: str):
+    """Sépare un nom de fichier en (base, numéro)"""
+    found = _NAME_RE.findall(name)
+    if found:
+        return found[0]
+    return name, ""
+
+def optimize_media(path: str, max_side: int) -> int:
+    """Ré-encode une image PNG, GIF ou JPEG pour réduire sa taille (exécuté dans un processus séparé)
+
+    L'image est réduite si un de ses côtés dépasse max_side pixels. Le fichier n'est remplacé que si le résultat est
+    plus léger. Renvoie le nombre d'octets économisés"""
+    ext = os.path.splitext(path)[1].lower()
+    if Image is None or ext not in (".png", ".gif", ".jpg", ".jpeg"):
+        return 0
+    before = os.path.getsize(path)
+    out = path + ".opt"
+    with Image.open(path) as img:
+        scale = min(1, max_side / max(img.size))
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        if ext == ".gif":
+            frames, durations = [], []
+            for frame in ImageSequence.Iterator(img):
+                durations.append(frame.info.get("duration", 100))
+                frame = frame.copy()
+                if scale < 1:
+                    frame = frame.resize(size)
+                frames.append(frame)
+            options = {"save_all": True, "append_images": frames[1:], "duration": durations,
+                       "loop": img.info.get("loop", 0), "optimize": True}
+            if "transparency" in img.info:
+                options["transparency"] = img.info["transparency"]
+            frames[0].save(out, format="GIF", **options)
+        elif ext == ".png":
+            frame = img.resize(size, Image.LANCZOS) if scale < 1 else img
+            frame.save(out, format="PNG", optimize=True)
+        elif scale < 1: # Pas de ré-encodage d'un JPEG s'il n'est pas redimensionné
+            img.resize(size, Image.LANCZOS).save(out, format="JPEG", quality=90, optimize=True)
+        else:
+            return 0
+    after = os.path.getsize(out)
+    if after < before:
+        os.replace(out, path)
+        return before - after
+    os.remove(out)
+    return 0
+
+class FloodGuard:
+    """Limiteur par seau à jetons (token bucket) pour chaque membre
+
+    Chaque seau se remplit de `rate` jetons par minute, jusqu'à `burst` jetons. Les seaux sont gardés dans l'ordre de
+    leur dernière utilisation avec l'heure à laquelle ils seront de nouveau pleins : ceux qui le sont sont retirés, ce
+    qui borne la mémoire utilisée sans dépendre des réglages des autres serveurs."""
+
+    def __init__(self, max_size: int = 10000):
+        self.buckets = OrderedDict()
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def consume(self, key, rate: float, burst: int) -> bool:
+        """Retire un jeton du seau et renvoie False s'il est vide"""
+        now = time.monotonic()
+        bucket = self.buckets.pop(key, None)
+        if bucket:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate / 60)
+        else:
+            tokens = burst
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, now + (burst - tokens) * 60 / rate)
+
+        while self.buckets:
+            oldest = next(iter(self.buckets.values()))
+            if now < oldest[2] and len(self.buckets) <= self.max_size:
+                break
+            self.buckets.popitem(last=False)
+        return allowed
+
+class MenuSession:
+    """Menu interactif (navigation, édition) exécuté dans sa propre tâche
+
+    Les réactions ne sont pas attendues avec bot.wait_for() : le listener on_reaction_add() de la cog les transmet
+    directement à la file de la session qui surveille le message concerné."""
+
+    def __init__(self, routes: dict, guild_id: int, user_id: int, kind: str):
+        self.routes = routes
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.kind = kind
+        self.message_id = None
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def watch(self, message):
+        """Fait suivre les réactions ajoutées sur ce message à la session"""
+        if message.id == self.message_id:
+            return
+        self.close()
+        self.message_id = message.id
+        self.routes[message.id] = self
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def wait_reaction(self, message, timeout: float):
+        """Attend la prochaine réaction de l'utilisateur sur le message, renvoie (réaction, utilisateur)"""
+        self.watch(message)
+        return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+
+    def close(self):
+        if self.message_id and self.routes.get(self.message_id) is self:
+            del self.routes[self.message_id]
+        self.message_id = None
+
+class StickerIndex:
+    """Index en mémoire des fichiers d'un serveur
+
+    Associe chaque nom à son fichier, chaque base de nom à ses variantes et garde une liste triée des noms pour
+    les recherches par préfixe."""
+
+    def __init__(self, files: list):
+        self.files = {file["name"]: file for file in files}
+        self.bases = {}
+        for name in self.files:
+            self.bases.setdefault(split_name(name)[0], set()).add(name)
+        self.names = sorted(self.files)
+        self.version = 0 # Incrémenté à chaque ajout, suppression ou renommage
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, name: str):
+        return name in self.files
+
+    def get(self, name: str) -> dict:
+        return self.files.get(name, {})
+
+    def add(self, file: dict):
+        name = file["name"]
+        if name not in self.files:
+            self.version += 1
+            bisect.insort(self.names, name)
+            self.bases.setdefault(split_name(name)[0], set()).add(name)
+        self.files[name] = file
+
+    def remove(self, name: str):
+        file = self.files.pop(name, None)
+        if file is not None:
+            self.version += 1
+            self.names.pop(bisect.bisect_left(self.names, name))
+            base = split_name(name)[0]
+            variants = self.bases.get(base, set())
+            variants.discard(name)
+            if not variants:
+                self.bases.pop(base, None)
+        return file
+
+    def rename(self, name: str, new_name: str):
+        file = self.remove(name)
+        if file is not None:
+            file["name"] = new_name
+            self.add(file)
+        return file
+
+    def similars(self, prefix: str) -> list:
+        """Fichiers dont le nom commence par le préfixe donné, triés par nom"""
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff")
+        return [self.files[name] for name in self.names[start:end]]
+
+    def resolve(self, name: str):
+        """Retrouve le nom réel d'un fichier en acceptant les alias 'foobar' / 'foobar1'"""
+        if name in self.files:
+            return name
+        if name + "1" in self.files:
+            return name + "1"
+        base, num = split_name(name)
+        if num == "1" and base in self.files:
+            return base
+        return None
+
+    def is_taken(self, name: str) -> bool:
+        """Vérifie si le nom (ou son alias 'foobar1') est déjà utilisé"""
+        if name in self.files:
+            return True
+        return name + "1" in self.bases.get(name, ())
+
 class Pixel(commands.Cog):
     """Stockage de stickers personnalisés"""
 
@@ -43,45 +268,178 @@ class Pixel(commands.Cog):
         folder.mkdir(exist_ok=True, parents=True)
         self.config = Config.get_conf(self, identifier=736144321857978388, force_registration=True)
         default_global = {"FOLDER_MAX_SIZE": 25e7, # 250 MB / guild
-                          "FILE_MAX_SIZE": 1e7} # 10 MB / file
+                          "FILE_MAX_SIZE": 1e7, # 10 MB / file
+                          "OPTIMIZE": False,
+                          "OPTIMIZE_MAX_SIDE": 1024,
+                          "BLOBS": {}} # Fichiers stockés par empreinte : {hash: {path, size, refs: {guild_id: n}}}
         default_guild = {"SETTINGS": {"need_approb": True,
                                       "channels_blacklist": [],
                                       "users_blacklist": [],
-                                      "antiflood": True},
-                         "WAITING": [],
-                         "FILES": []}
+                                      "antiflood": True,
+                                      "flood_rate": 3, # Fichiers par minute et par membre
+                                      "flood_burst": 3,
+                                      "cache_budget": 0}, # Octets alloués au cache des fichiers en ligne
+                         "WAITING": [], # Ancien format, converti par migrate()
+                         "FILES": [], # Ancien format, converti par migrate()
+                         "PROPOSALS": {}, # Fichiers en attente d'approbation : {nom: fichier}
+                         "STICKERS": {}, # Fichiers approuvés : {nom: fichier}
+                         "STORAGE": None, # Octets occupés en local, None si jamais calculé
+                         "SAVED": 0} # Octets économisés par l'optimisation des images
         self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
-        self.cooldown = {}
-
-
-    def _get_folder_size(self, path):
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                total_size += os.path.getsize(fp)
-        return int(total_size)
+        self.flood = FloodGuard()
+        self.indexes = {}
+        self.used = {}
+        self.probes = {}
+        self.blobs_lock = asyncio.Lock()
+        self.url_cache = {}
+        self.list_cache = {}
+        self.sessions = {}
+        self.guild_sessions = {}
+        self.uploads = 0
+        self.scan_lock = asyncio.Lock()
+
+        self.session = None
+        self.pool = None
+        self.background_loop = None
+
+    async def initialize(self):
+        await self.migrate()
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15, connect=5))
+        self._enable_bg_loop()
+
+    async def migrate(self):
+        """Convertit les listes FILES et WAITING des serveurs en dictionnaires indexés par nom
+
+        Renseigne aussi la taille des fichiers qui n'en ont pas encore (données antérieures au registre d'espace),
+        avec une seule écriture par serveur"""
+        for guild_id, data in (await self.config.all_guilds()).items():
+            group = self.config.guild_from_id(guild_id)
+            converted = bool(data.get("FILES") or data.get("WAITING"))
+            stickers = data.get("STICKERS") or {}
+            for file in data.get("FILES", []):
+                stickers.setdefault(file["name"], file)
+            proposals = data.get("PROPOSALS") or {}
+            for file in data.get("WAITING", []):
+                proposals.setdefault(file["name"], file)
+            sized = {}
+            for section, files in (("STICKERS", stickers), ("PROPOSALS", proposals)):
+                for file in files.values():
+                    if "size" not in file:
+                        file["size"] = self._get_local_file_size(file["path"]) if file.get("path") else 0
+                        sized[section] = sized.get(section, 0) + 1
+            if converted or "STICKERS" in sized:
+                await group.STICKERS.set(stickers)
+            if converted or "PROPOSALS" in sized:
+                await group.PROPOSALS.set(proposals)
+            if converted:
+                await group.FILES.clear()
+                await group.WAITING.clear()
+                logger.info(f"Données du serveur {guild_id} converties ({len(stickers)} fichiers, "
+                            f"{len(proposals)} propositions)")
+            if sized:
+                logger.info(f"Taille de {sum(sized.values())} fichiers renseignée (serveur {guild_id})")
+
+    def _enable_bg_loop(self):
+        self.background_loop = self.bot.loop.create_task(self.loop())
+
+        def error_handler(future: asyncio.Future):
+            try:
+                future.result()
+            except asyncio.CancelledError:
+                pass
+            except Exception as exc:
+                logger.exception(
+                    "Erreur dans la loop de Pixel: ",
+                    exc_info=exc,
+                )
+        self.background_loop.add_done_callback(error_handler)
+
+    async def loop(self):
+        await self.bot.wait_until_ready()
+        last_gc = last_cache = last_scan = time.time()
+        while True:
+            await asyncio.sleep(_FLUSH_DELAY)
+            await self.flush_counters()
+            if last_gc + _GC_DELAY < time.time():
+                last_gc = time.time()
+                await self.collect_blobs()
+            if last_cache + _CACHE_DELAY < time.time():
+                last_cache = time.time()
+                for guild_id in list(self.indexes):
+                    guild = self.bot.get_guild(guild_id)
+                    if guild:
+                        await self.refresh_url_cache(guild)
+            if last_scan + _SCAN_DELAY < time.time() and not self.uploads:
+                report = await self.scan_integrity()
+                if report is not None:
+                    last_scan = time.time()
+
+    def cog_unload(self):
+        if self.background_loop:
+            self.background_loop.cancel()
+        for sessions in self.guild_sessions.values():
+            for session in list(sessions):
+                session.task.cancel()
+        asyncio.create_task(self.flush_counters())
+        if self.session:
+            asyncio.create_task(self.session.close())
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+
+    def _scan_folder(self, path):
+        """Renvoie la taille de chaque fichier contenu dans le dossier (à exécuter dans un executor)"""
+        sizes = {}
+        if not os.path.isdir(path):
+            return sizes
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    sizes[entry.path] = entry.stat(follow_symlinks=False).st_size
+        return sizes
 
     def _get_local_file_size(self, path):
         if os.path.exists(path):
             return int(os.path.getsize(path))
         return 0
 
-    def _get_file_length(self, url):
-        h = requests.head(url, allow_redirects=True)
-        header = h.headers
-        content_length = header.get('content-length', None)
+    async def probe(self, url: str) -> dict:
+        """Récupère les en-têtes d'une URL avec une requête HEAD (résultat gardé en cache quelques minutes)
+
+        Renvoie un dict vide si l'URL ne répond pas correctement. Un échec n'est gardé que quelques secondes, pour ne pas
+        refuser une URL pendant plusieurs minutes après une erreur passagère"""
+        now = time.time()
+        cached = self.probes.get(url)
+        if cached and cached[0] > now:
+            return cached[1]
+        headers = {}
+        try:
+            async with self.session.head(url, allow_redirects=True, max_redirects=5) as resp:
+                if resp.status < 400:
+                    headers = {"type": resp.headers.get("content-type"),
+                               "length": resp.headers.get("content-length")}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            logger.info(f"Requête HEAD impossible sur {url}", exc_info=True)
+        if len(self.probes) >= _PROBE_CACHE_SIZE:
+            self.probes = {u: c for u, c in self.probes.items() if c[0] > now}
+            if len(self.probes) >= _PROBE_CACHE_SIZE:
+                self.probes.clear()
+        self.probes[url] = (now + (_PROBE_TTL if headers else _PROBE_FAIL_TTL), headers)
+        return headers
+
+    async def _get_file_length(self, url):
+        content_length = (await self.probe(url)).get("length")
         if content_length:
             return content_length
         else:
             return None
 
-    def _get_file_type(self, url):
-        h = requests.head(url, allow_redirects=True)
-        header = h.headers
-        content_type = header.get('content-type')
-        return content_type.split("/")[0]
+    async def _get_file_type(self, url):
+        content_type = (await self.probe(url)).get("type")
+        if content_type:
+            return content_type.split("/")[0]
+        return None
 
     def humanize_size(self, b: int):
         if b > 1000:
@@ -93,41 +451,442 @@ class Pixel(commands.Cog):
         return f"{b} B"
 
 
+    async def get_index(self, guild: discord.Guild) -> StickerIndex:
+        """Renvoie l'index en mémoire des fichiers du serveur (chargé à la première demande)"""
+        if guild.id not in self.indexes:
+            self.indexes[guild.id] = StickerIndex(list((await self.config.guild(guild).STICKERS()).values()))
+        return self.indexes[guild.id]
+
+    async def save_file(self, guild: discord.Guild, file: dict):
+        """Enregistre (ou met à jour) un fichier et l'index du serveur"""
+        await self.config.guild(guild).STICKERS.set_raw(file["name"], value=file)
+        index = await self.get_index(guild)
+        index.add(file)
+
+    async def delete_file(self, guild: discord.Guild, name: str):
+        """Supprime les données d'un fichier et le retire de l'index du serveur"""
+        self.used.get(guild.id, set()).discard(name)
+        await self.config.guild(guild).STICKERS.clear_raw(name)
+        index = await self.get_index(guild)
+        index.remove(name)
+
+    async def rename_file(self, guild: discord.Guild, name: str, new_name: str):
+        """Renomme un fichier dans les données et dans l'index du serveur"""
+        used = self.used.get(guild.id, set())
+        if name in used:
+            used.discard(name)
+            used.add(new_name)
+        index = await self.get_index(guild)
+        file = index.rename(name, new_name)
+        await self.config.guild(guild).STICKERS.set_raw(new_name, value=file)
+        await self.config.guild(guild).STICKERS.clear_raw(name)
+
+    def add_use(self, guild: discord.Guild, file: dict):
+        """Incrémente le compteur d'utilisation en mémoire, sauvegardé plus tard par flush_counters()"""
+        file["count"] += 1
+        self.used.setdefault(guild.id, set()).add(file["name"])
+
+    async def flush_counters(self):
+        """Sauvegarde les compteurs d'utilisation modifiés depuis la dernière fois"""
+        pending, self.used = self.used, {}
+        for guild_id, names in pending.items():
+            index = self.indexes.get(guild_id)
+            if not index:
+                continue
+            try:
+                async with self.config.guild_from_id(guild_id).STICKERS() as stickers:
+                    for name in names:
+                        if name in index and name in stickers:
+                            stickers[name]["count"] = index.get(name)["count"]
+            except Exception:
+                logger.error(f"Impossible de sauvegarder les compteurs du serveur {guild_id}", exc_info=True)
+                self.used.setdefault(guild_id, set()).update(names)
+
+    async def get_storage(self, guild: discord.Guild) -> int:
+        """Renvoie l'espace occupé en local par le serveur d'après le registre (calculé une fois si absent)"""
+        storage = await self.config.guild(guild).STORAGE()
+        if storage is None:
+            storage = await self.reconcile_storage(guild)
+        return storage
+
+    async def update_storage(self, guild: discord.Guild, delta: int):
+        """Ajoute (ou retire) des octets au registre d'espace du serveur"""
+        async with self.config.guild(guild).STORAGE.get_lock():
+            storage = await self.config.guild(guild).STORAGE()
+            if storage is not None:
+                await self.config.guild(guild).STORAGE.set(max(0, storage + int(delta)))
+
+    async def reconcile_storage(self, guild: discord.Guild) -> int:
+        """Recalcule le registre d'espace, la taille des fichiers et les références du serveur à partir du disque
+
+        Un fichier partagé (même empreinte) n'est compté qu'une fois par serveur"""
+        path = await self.guild_path(guild)
+        sizes = await self.bot.loop.run_in_executor(None, self._scan_folder, str(path))
+        total = sum(sizes.values())
+        index = await self.get_index(guild)
+        files = await self.config.guild(guild).STICKERS()
+        waiting = await self.config.guild(guild).PROPOSALS()
+        refs = {}
+        for file in list(files.values()) + list(waiting.values()):
+            if file.get("hash") and file["path"]:
+                refs[file["hash"]] = refs.get(file["hash"], 0) + 1
+
+        gid = str(guild.id)
+        async with self.blobs_lock:
+            blobs = await self.config.BLOBS()
+            changed = False
+            for digest, blob in blobs.items():
+                if blob["refs"].get(gid, 0) != refs.get(digest, 0):
+                    if digest in refs:
+                        blob["refs"][gid] = refs[digest]
+                    else:
+                        del blob["refs"][gid]
+                    changed = True
+            if changed:
+                await self.config.BLOBS.set(blobs)
+        for digest in refs:
+            if digest in blobs:
+                sizes[blobs[digest]["path"]] = blobs[digest]["size"]
+                total += blobs[digest]["size"]
+
+        changed = False
+        for name, file in files.items():
+            size = sizes.get(file["path"], 0) if file["path"] else 0
+            if file.get("size") != size:
+                file["size"] = size
+                changed = True
+            if name in index:
+                index.get(name)["size"] = size
+        if changed:
+            async with self.config.guild(guild).STICKERS() as stickers:
+                for name, file in files.items():
+                    if name in stickers:
+                        stickers[name]["size"] = file["size"]
+        changed = False
+        for file in waiting.values():
+            size = sizes.get(file["path"], 0) if file["path"] else 0
+            if file.get("size") != size:
+                file["size"] = size
+                changed = True
+        if changed:
+            async with self.config.guild(guild).PROPOSALS() as proposals:
+                for name, file in waiting.items():
+                    if name in proposals:
+                        proposals[name]["size"] = file["size"]
+        await self.config.guild(guild).STORAGE.set(total)
+        return total
+
+    async def remove_local(self, guild: discord.Guild, file: dict):
+        """Supprime le fichier local lié à un fichier et le retire du registre d'espace du serveur
+
+        Les fichiers partagés ne sont pas supprimés directement : ils perdent une référence et seront nettoyés par
+        collect_blobs() lorsqu'ils ne seront plus utilisés. Le chemin du fichier est effacé dans tous les cas."""
+        if file.get("hash"):
+            await self.release_blob(guild, file["hash"])
+        elif self.is_blob_path(file["path"]):
+            logger.warning(f"Le fichier {file['name']} pointe vers un fichier partagé sans empreinte, "
+                           f"il sera nettoyé par la vérification d'intégrité")
+        else:
+            size = file.get("size")
+            if size is None:
+                size = self._get_local_file_size(file["path"])
+            os.remove(file["path"])
+            await self.update_storage(guild, -size)
+        file["path"] = None
+        file["size"] = 0
+        file.pop("hash", None)
+        file.pop("cdn", None)
+
+    def is_blob_path(self, path: str) -> bool:
+        """Indique si le chemin se trouve dans le stockage par empreinte (supprimé uniquement par collect_blobs())"""
+        blobs = os.path.normpath(str(cog_data_path(self) / "local/blobs"))
+        return os.path.normpath(path).startswith(blobs + os.sep)
+
+    def _hash_file(self, path: str):
+        """Calcule l'empreinte SHA-256 et la taille d'un fichier (à exécuter dans un executor)"""
+        sha = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                sha.update(chunk)
+                size += len(chunk)
+        return sha.hexdigest(), size
+
+    async def optimize(self, guild: discord.Guild, path: str) -> int:
+        """Optimise une image importée dans un processus séparé si l'option est activée
+
+        Renvoie le nombre d'octets économisés, ajouté au total du serveur"""
+        if Image is None or not await self.config.OPTIMIZE():
+            return 0
+        if not self.pool:
+            self.pool = ProcessPoolExecutor(max_workers=2)
+        task = self.bot.loop.run_in_executor(self.pool, optimize_media, path, await self.config.OPTIMIZE_MAX_SIDE())
+        try:
+            saved = await asyncio.wait_for(task, timeout=60)
+        except Exception:
+            logger.error(f"Impossible d'optimiser {path}", exc_info=True)
+            return 0
+        if saved:
+            async with self.config.guild(guild).SAVED.get_lock():
+                await self.config.guild(guild).SAVED.set(await self.config.guild(guild).SAVED() + saved)
+        return saved
+
+    @contextmanager
+    def uploading(self):
+        """Signale un import en cours : la vérification d'intégrité ne s'exécute pas pendant ce temps"""
+        self.uploads += 1
+        try:
+            yield
+        finally:
+            self.uploads -= 1
+
+    def temp_path(self, filename: str) -> str:
+        path = cog_data_path(self) / "local/tmp"
+        path.mkdir(exist_ok=True, parents=True)
+        return "{}/{}_{}".format(str(path), int(time.time() * 1000), filename)
+
+    async def blob_cost(self, guild: discord.Guild, digest: str, size: int) -> int:
+        """Octets qui seraient ajoutés au registre du serveur s'il référençait ce fichier"""
+        try:
+            refs = await self.config.BLOBS.get_raw(digest, "refs")
+        except KeyError:
+            return size
+        return 0 if refs.get(str(guild.id)) else size
+
+    async def store_blob(self, guild: discord.Guild, temp: str, digest: str, size: int, ext: str) -> str:
+        """Déplace un fichier temporaire dans le stockage par empreinte et y ajoute une référence du serveur
+
+        Si un fichier identique est déjà stocké, le fichier temporaire est supprimé. Renvoie le chemin final."""
+        async with self.blobs_lock:
+            try:
+                blob = await self.config.BLOBS.get_raw(digest)
+            except KeyError:
+                blob = None
+            blob, cost = self._place_blob(blob, guild, temp, digest, size, ext)
+            await self.config.BLOBS.set_raw(digest, value=blob)
+        if cost:
+            await self.update_storage(guild, cost)
+        return blob["path"]
+
+    def _place_blob(self, blob, guild: discord.Guild, temp: str, digest: str, size: int, ext: str):
+        """Range le fichier temporaire à l'emplacement du fichier stocké (créé si `blob` est None) et y ajoute une
+        référence du serveur
+
+        Renvoie (fichier stocké, octets ajoutés au registre du serveur)"""
+        if blob is None:
+            folder = cog_data_path(self) / f"local/blobs/{digest[:2]}"
+            folder.mkdir(exist_ok=True, parents=True)
+            blob = {"path": "{}/{}{}".format(str(folder), digest, ext.lower()), "size": size, "refs": {}}
+        if os.path.exists(blob["path"]):
+            os.remove(temp)
+        else:
+            os.replace(temp, blob["path"])
+        gid = str(guild.id)
+        cost = 0 if blob["refs"].get(gid) else blob["size"]
+        blob["refs"][gid] = blob["refs"].get(gid, 0) + 1
+        return blob, cost
+
+    async def release_blob(self, guild: discord.Guild, digest: str):
+        """Retire une référence du serveur à un fichier stocké par empreinte"""
+        gid = str(guild.id)
+        async with self.blobs_lock:
+            try:
+                blob = await self.config.BLOBS.get_raw(digest)
+            except KeyError:
+                return
+            count = blob["refs"].get(gid, 0) - 1
+            if count > 0:
+                blob["refs"][gid] = count
+            else:
+                blob["refs"].pop(gid, None)
+            await self.config.BLOBS.set_raw(digest, value=blob)
+        if count <= 0:
+            await self.update_storage(guild, -blob["size"])
+
+    async def collect_blobs(self) -> int:
+        """Supprime les fichiers stockés par empreinte qui ne sont plus référencés par aucun serveur
+
+        Renvoie le nombre d'octets libérés"""
+        freed = 0
+        async with self.blobs_lock:
+            blobs = await self.config.BLOBS()
+            collected = []
+            for digest, blob in blobs.items():
+                if not blob["refs"]:
+                    try:
+                        os.remove(blob["path"])
+                        freed += blob["size"]
+                    except FileNotFoundError:
+                        pass
+                    except OSError:
+                        logger.error(f"Impossible de supprimer le fichier {digest}", exc_info=True)
+                        continue
+                    collected.append(digest)
+            if collected:
+                async with self.config.BLOBS() as current:
+                    for digest in collected:
+                        current.pop(digest, None)
+        if freed:
+            logger.info(f"{self.humanize_size(freed)} libérés par le nettoyage des fichiers inutilisés")
+        return freed
+
+    def _scan_tree(self, path: str):
+        """Renvoie la taille et la date de modification de chaque fichier de l'arborescence (à exécuter dans un executor)"""
+        found = {}
+        if not os.path.isdir(path):
+            return found
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    found.update(self._scan_tree(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    found[os.path.normpath(entry.path)] = (stat.st_size, stat.st_mtime)
+        return found
+
+    def _remove_files(self, paths: list):
+        """Supprime les fichiers et renvoie les chemins effectivement supprimés (à exécuter dans un executor)"""
+        removed = []
+        for path in paths:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.error(f"Impossible de supprimer le fichier orphelin {path}", exc_info=True)
+        return removed
+
+    async def scan_integrity(self):
+        """Compare le stockage local avec les données des serveurs
+
+        Supprime les fichiers orphelins (qu'aucune donnée ne référence), retire les chemins des fichiers qui n'existent
+        plus et recalcule le registre des serveurs concernés. S'interrompt dès qu'un import est en cours.
+        Renvoie un dict {"freed", "orphans", "dangling"} ou None si la vérification n'a pas pu avoir lieu."""
+        if self.uploads or self.scan_lock.locked():
+            return None
+        async with self.scan_lock:
+            root = cog_data_path(self) / "local"
+            disk = await self.bot.loop.run_in_executor(None, self._scan_tree, str(root))
+            blobs = await self.config.BLOBS()
+            known = {os.path.normpath(blob["path"]) for blob in blobs.values()}
+            dangling = []
+            for gid, data in (await self.config.all_guilds()).items():
+                for section in ("STICKERS", "PROPOSALS"):
+                    for name, file in data.get(section, {}).items():
+                        if not file.get("path"):
+                            continue
+                        path = os.path.normpath(file["path"])
+                        if path in disk:
+                            known.add(path)
+                        else:
+                            dangling.append((gid, section, name, file["path"]))
+
+            affected = set()
+            limit = time.time() - _ORPHAN_AGE
+            orphans = [path for path, (size, mtime) in disk.items() if path not in known and mtime < limit]
+            # Les fichiers du stockage par empreinte ne sont supprimés que par collect_blobs() : ils y sont enregistrés
+            # sans référence, sous leur empreinte si elle est libre (un import identique pourra alors les réutiliser)
+            shared = [path for path in orphans if self.is_blob_path(path)]
+            orphans = [path for path in orphans if not self.is_blob_path(path)]
+            freed = removed = 0
+            if shared:
+                async with self.blobs_lock:
+                    async with self.config.BLOBS() as current:
+                        for path in shared:
+                            key = os.path.splitext(os.path.basename(path))[0]
+                            if key in current:
+                                key = os.path.basename(path)
+                            if key not in current:
+                                current[key] = {"path": path, "size": disk[path][0], "refs": {}}
+                                removed += 1
+                freed += await self.collect_blobs()
+            for i in range(0, len(orphans), _SCAN_BATCH):
+                if self.uploads:
+                    return None
+                done = await self.bot.loop.run_in_executor(None, self._remove_files, orphans[i:i + _SCAN_BATCH])
+                for path in done:
+                    freed += disk[path][0]
+                    folder = os.path.basename(os.path.dirname(path))
+                    if folder.isdigit():
+                        affected.add(int(folder))
+                removed += len(done)
+                await asyncio.sleep(1)
+
+            cleared = 0
+            sections = {}
+            for gid, section, name, path in dangling:
+                sections.setdefault((gid, section), []).append((name, path))
+            for (gid, section), entries in sections.items():
+                index = self.indexes.get(gid) if section == "STICKERS" else None
+                async with getattr(self.config.guild_from_id(gid), section)() as files:
+                    for name, path in entries:
+                        if name not in files:
+                            continue
+                        file = files[name]
+                        if index and name in index:
+                            file = index.get(name) # Modifié sur place pour garder le compteur non sauvegardé
+                        if file.get("path") != path or os.path.exists(path):
+                            continue
+                        file["path"] = None
+                        file["size"] = 0
+                        file.pop("hash", None)
+                        file.pop("cdn", None)
+                        files[name] = dict(file)
+                        affected.add(gid)
+                        cleared += 1
+            async with self.blobs_lock:
+                async with self.config.BLOBS() as current:
+                    for digest, blob in blobs.items():
+                        if os.path.normpath(blob["path"]) not in disk and not os.path.exists(blob["path"]):
+                            current.pop(digest, None)
+                            affected.update(int(gid) for gid in blob["refs"])
+                            cleared += 1
+
+            for gid in affected:
+                guild = self.bot.get_guild(gid)
+                if guild:
+                    await self.reconcile_storage(guild)
+        if removed or cleared:
+            logger.info(f"Vérification du stockage : {removed} fichiers orphelins supprimés "
+                        f"({self.humanize_size(freed)} libérés), {cleared} références invalides retirées")
+        return {"freed": freed, "orphans": removed, "dangling": cleared}
+
     async def get_file(self, guild: discord.Guild, name: str) -> dict:
-        for file in await self.config.guild(guild).FILES():
-            if file["name"] == name:
-                return file
-        return {}
+        index = await self.get_index(guild)
+        return index.get(name)
 
     async def files_list(self, guild: discord.Guild):
-        data = await self.config.guild(guild).FILES()
-        return [i["name"] for i in data]
+        index = await self.get_index(guild)
+        return list(index.names)
 
 
     async def get_waiting(self, guild: discord.Guild, name: str) -> dict:
-        for file in await self.config.guild(guild).WAITING():
-            if file["name"] == name:
-                return file
-        return {}
+        try:
+            return await self.config.guild(guild).PROPOSALS.get_raw(name)
+        except KeyError:
+            return {}
 
     async def waiting_list(self, guild: discord.Guild):
-        data = await self.config.guild(guild).WAITING()
-        return [i["name"] for i in data]
+        data = await self.config.guild(guild).PROPOSALS()
+        return list(data)
+
+    async def save_waiting(self, guild: discord.Guild, file: dict):
+        await self.config.guild(guild).PROPOSALS.set_raw(file["name"], value=file)
+
+    async def delete_waiting(self, guild: discord.Guild, name: str):
+        await self.config.guild(guild).PROPOSALS.clear_raw(name)
 
     async def get_similars(self, guild: discord.Guild, base_name: str):
-        data = await self.config.guild(guild).FILES()
-        similars = []
-        for file in data:
-            if file["name"].startswith(base_name):
-                similars.append(file)
-        return similars
+        index = await self.get_index(guild)
+        return index.similars(base_name)
 
     async def find_disp_name(self, guild: discord.Guild, base_name: str):
-        similars = await self.get_similars(guild, base_name)
-        if similars:
+        index = await self.get_index(guild)
+        if index.similars(base_name):
             n = 2
             name = f"{base_name}{n}"
-            while name in [file["name"] for file in similars]:
+            while name in index:
                 n += 1
                 name = f"{base_name}{n}"
             return name
@@ -142,66 +901,99 @@ class Pixel(commands.Cog):
 
     async def download_attachment(self, msg: discord.Message, name: str, waiting: bool = False):
         guild = msg.guild
-        path = await self.guild_path(guild)
-        seed = str(int(time.time()))
         ext = os.path.splitext(msg.attachments[0].filename)[1]
-        if ext.lower() in [".jpeg", ".jpg", ".png", ".gif", ".gifv", ".mp3", ".wav", ".mp4", ".webm", ".txt"]:
+        if ext.lower() in _EXTENSIONS:
             if msg.attachments[0].size <= await self.config.FILE_MAX_SIZE():
-                if msg.attachments[0].size + self._get_folder_size(str(path)) <= await self.config.FOLDER_MAX_SIZE():
-                    filename = "{}_{}".format(seed, msg.attachments[0].filename)
-                    filepath = "{}/{}".format(str(path), filename)
-
-                    if waiting:
-                        data = await self.config.guild(guild).WAITING()
-                    else:
-                        data = await self.config.guild(guild).FILES()
-                    new = {"name": name,
-                           "path": filepath,
-                           "url": msg.attachments[0].url,
-                           "author": msg.author.id,
-                           "creation": time.time(),
-                           "count": 0}
-                    data.append(new)
-                    await msg.attachments[0].save(filepath)
-
-                    if waiting:
-                        await self.config.guild(guild).WAITING.set(data)
+                with self.uploading():
+                    temp = self.temp_path(msg.attachments[0].filename)
+                    await msg.attachments[0].save(temp)
+                    await self.optimize(guild, temp)
+                    digest, size = await self.bot.loop.run_in_executor(None, self._hash_file, temp)
+                    if await self.blob_cost(guild, digest, size) + await self.get_storage(guild) <= await self.config.FOLDER_MAX_SIZE():
+                        filepath = await self.store_blob(guild, temp, digest, size, ext)
+                        new = {"name": name,
+                               "path": filepath,
+                               "url": msg.attachments[0].url,
+                               "author": msg.author.id,
+                               "creation": time.time(),
+                               "count": 0,
+                               "size": size,
+                               "hash": digest}
+
+                        if waiting:
+                            await self.save_waiting(guild, new)
+                        else:
+                            await self.save_file(guild, new)
                     else:
-                        await self.config.guild(guild).FILES.set(data)
-                else:
-                    raise MaxFolderSize()
+                        self._discard(temp)
+                        raise MaxFolderSize()
             else:
                 raise MaxFileSize()
         else:
             raise ExtensionNotSupported()
 
+    async def stream_download(self, url: str, filepath: str, limit: float) -> int:
+        """Télécharge le fichier par morceaux dans un fichier temporaire, renommé une fois complet
+
+        Abandonne (MaxFileSize) dès que la limite d'octets est dépassée et renvoie la taille du fichier écrit"""
+        temp = filepath + ".part"
+        size = 0
+        try:
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise DownloadError()
+                if resp.content_length and resp.content_length > limit:
+                    raise MaxFileSize()
+                async with aiofiles.open(temp, mode='wb') as f:
+                    async for chunk in resp.content.iter_chunked(_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > limit:
+                            raise MaxFileSize()
+                        await f.write(chunk)
+            os.replace(temp, filepath)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._discard(temp)
+            raise DownloadError()
+        except Exception:
+            self._discard(temp)
+            raise
+        return size
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
     async def replace_download(self, guild: discord.Guild, name: str, url: str):
-        path = await self.guild_path(guild)
-        seed = str(int(time.time()))
         file_name, ext = os.path.splitext(os.path.basename(urlsplit(url).path))
-        file_size = float(self._get_file_length(url))
+        file_size = float(await self._get_file_length(url) or 0)
         if name in await self.files_list(guild) + await self.waiting_list(guild):
-            if ext.lower() in [".jpeg", ".jpg", ".png", ".gif", ".gifv", ".mp3", ".wav", ".mp4", ".webm", ".txt"]:
-                if file_size <= await self.config.FILE_MAX_SIZE():
-                    if file_size +  self._get_folder_size(str(path)) <= await self.config.FOLDER_MAX_SIZE():
-                        filename = "{}_{}{}".format(seed, file_name, ext)
-                        filepath = "{}/{}".format(str(path), filename)
-
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(url) as resp:
-                                if resp.status == 200:
-                                    f = await aiofiles.open(str(filepath), mode='wb')
-                                    await f.write(await resp.read())
-                                    await f.close()
-                                else:
-                                    raise DownloadError()
-
-                        file = await self.get_file(guild, name)
-                        data = await self.config.guild(guild).FILES()
-                        index = data.index(file)
-                        file["path"] = filepath
-                        data[index] = file
-                        await self.config.guild(guild).FILES.set(data)
+            if ext.lower() in _EXTENSIONS:
+                file_max = await self.config.FILE_MAX_SIZE()
+                if file_size <= file_max:
+                    folder_room = await self.config.FOLDER_MAX_SIZE() - await self.get_storage(guild)
+                    if file_size <= folder_room:
+                        with self.uploading():
+                            temp = self.temp_path(file_name + ext)
+
+                            limit = min(file_max, folder_room)
+                            try:
+                                await self.stream_download(url, temp, limit)
+                            except MaxFileSize:
+                                if limit < file_max:
+                                    raise MaxFolderSize()
+                                raise
+
+                            await self.optimize(guild, temp)
+                            digest, size = await self.bot.loop.run_in_executor(None, self._hash_file, temp)
+                            filepath = await self.store_blob(guild, temp, digest, size, ext)
+                            file = await self.get_file(guild, name)
+                            file["path"] = filepath
+                            file["size"] = size
+                            file["hash"] = digest
+                            file.pop("cdn", None)
+                            await self.save_file(guild, file)
                     else:
                         raise MaxFolderSize()
                 else:
@@ -211,6 +1003,356 @@ class Pixel(commands.Cog):
         else:
             raise NameError()
 
+    def _write_archive(self, target: str, manifest: dict, entries: list):
+        """Écrit l'archive d'un serveur fichier par fichier (à exécuter dans un executor)
+
+        Les fichiers sont copiés par morceaux dans l'archive sans être recompressés, ils ne sont jamais chargés
+        entièrement en mémoire"""
+        temp = target + ".part"
+        try:
+            with zipfile.ZipFile(temp, "w") as zf:
+                zf.writestr(_MANIFEST, json.dumps(manifest), compress_type=zipfile.ZIP_DEFLATED)
+                for path, arcname in entries:
+                    zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+            os.replace(temp, target)
+        except Exception:
+            self._discard(temp)
+            raise
+        return os.path.getsize(target)
+
+    async def export_pack(self, guild: discord.Guild):
+        """Crée une archive zip des fichiers du serveur (manifeste des données + fichiers locaux)
+
+        Renvoie (chemin de l'archive, nombre de fichiers, taille de l'archive)"""
+        index = await self.get_index(guild)
+        stickers, entries = [], []
+        for file in index.files.values():
+            data = {k: v for k, v in file.items() if k not in ("path", "hash", "cdn", "size")}
+            if file["path"] and os.path.exists(file["path"]):
+                data["archive"] = "files/{}{}".format(file["name"], os.path.splitext(file["path"])[1].lower())
+                entries.append((file["path"], data["archive"]))
+            stickers.append(data)
+        manifest = {"format": 1, "guild": guild.id, "creation": time.time(), "stickers": stickers}
+        folder = cog_data_path(self) / "exports"
+        folder.mkdir(exist_ok=True, parents=True)
+        for old in folder.glob(f"{guild.id}_*.zip"): # Archives conservées par les anciennes versions
+            self._discard(str(old))
+        target = "{}/{}.zip".format(str(folder), guild.id) # Une seule archive par serveur, remplacée à chaque export
+        size = await self.bot.loop.run_in_executor(None, self._write_archive, target, manifest, entries)
+        return target, len(stickers), size
+
+    def _read_manifest(self, archive: str):
+        """Lit le manifeste d'une archive et la taille déclarée de chaque fichier (à exécuter dans un executor)"""
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                sizes = {info.filename: info.file_size for info in zf.infolist()}
+                with zf.open(_MANIFEST) as f:
+                    manifest = json.load(f)
+        except (zipfile.BadZipFile, KeyError, ValueError):
+            raise InvalidArchive()
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("stickers"), list):
+            raise InvalidArchive()
+        return manifest, sizes
+
+    def _extract_entry(self, archive: str, arcname: str, temp: str, limit: float):
+        """Extrait un fichier de l'archive par morceaux et renvoie son empreinte et sa taille (à exécuter dans un executor)"""
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with zipfile.ZipFile(archive) as zf, zf.open(arcname) as src, open(temp, "wb") as dst:
+                for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if size > limit:
+                        raise MaxFileSize()
+                    sha.update(chunk)
+                    dst.write(chunk)
+        except (zipfile.BadZipFile, KeyError):
+            self._discard(temp)
+            raise InvalidArchive()
+        except Exception:
+            self._discard(temp)
+            raise
+        return sha.hexdigest(), size
+
+    async def import_pack(self, guild: discord.Guild, author: discord.Member, archive: str) -> dict:
+        """Importe les fichiers d'une archive créée par export_pack()
+
+        Les noms déjà pris ou invalides et les fichiers sans URL ni fichier supporté dans l'archive sont ignorés.
+        L'espace nécessaire est vérifié en une fois avant toute extraction (MaxFolderSize), puis les fichiers sont
+        enregistrés ensemble. Renvoie {"added": [noms], "skipped": [noms]}"""
+        manifest, sizes = await self.bot.loop.run_in_executor(None, self._read_manifest, archive)
+        index = await self.get_index(guild)
+        waiting = set(await self.waiting_list(guild))
+        file_max = await self.config.FILE_MAX_SIZE()
+        plan, planned, skipped, needed = [], set(), [], 0
+        for data in manifest["stickers"]:
+            if not isinstance(data, dict):
+                continue
+            name, url, arcname = data.get("name"), data.get("url"), data.get("archive")
+            if not isinstance(name, str) or not name or ":" in name or name.lower() in ["list", "liste"] \
+                    or index.is_taken(name) or name in waiting or name in planned:
+                skipped.append(str(name))
+                continue
+            if not isinstance(url, str) or not url.startswith("http"):
+                url = ""
+            if arcname:
+                if not isinstance(arcname, str) or arcname not in sizes \
+                        or os.path.splitext(arcname)[1].lower() not in _EXTENSIONS or sizes[arcname] > file_max:
+                    arcname = None
+                else:
+                    needed += sizes[arcname]
+            if not arcname and not url:
+                skipped.append(name)
+                continue
+            plan.append((name, data, url, arcname))
+            planned.add(name)
+        if needed > await self.config.FOLDER_MAX_SIZE() - await self.get_storage(guild):
+            raise MaxFolderSize()
+
+        records, temps = {}, []
+        with self.uploading():
+            try:
+                for name, data, url, arcname in plan:
+                    member = guild.get_member(data.get("author")) if isinstance(data.get("author"), int) else None
+                    count, creation = data.get("count"), data.get("creation")
+                    new = {"name": name,
+                           "path": None,
+                           "url": url,
+                           "author": member.id if member else author.id,
+                           "creation": creation if isinstance(creation, (int, float)) and creation > 0 else time.time(),
+                           "count": count if isinstance(count, int) and count >= 0 else 0}
+                    if arcname:
+                        ext = os.path.splitext(arcname)[1]
+                        temp = self.temp_path(name + ext)
+                        temps.append(temp)
+                        new["hash"], new["size"] = await self.bot.loop.run_in_executor(None, self._extract_entry,
+                                                                                       archive, arcname, temp, file_max)
+                        new["path"] = temp
+                    records[name] = new
+
+                cost = 0
+                async with self.blobs_lock:
+                    async with self.config.BLOBS() as blobs:
+                        for new in records.values():
+                            if new["path"]:
+                                blob, added = self._place_blob(blobs.get(new["hash"]), guild, new["path"], new["hash"],
+                                                               new["size"], os.path.splitext(new["path"])[1])
+                                blobs[new["hash"]] = blob
+                                new["path"] = blob["path"]
+                                cost += added
+            finally:
+                for temp in temps:
+                    self._discard(temp)
+        if cost:
+            await self.update_storage(guild, cost)
+        async with self.config.guild(guild).STICKERS() as stickers:
+            stickers.update(records)
+        for new in records.values():
+            index.add(new)
+        return {"added": list(records), "skipped": skipped}
+
+    async def send_local(self, channel: discord.TextChannel, file: dict):
+        """Envoie le fichier local d'un sticker
+
+        Après le premier envoi, l'URL de la pièce jointe sur le CDN de Discord est gardée et réutilisée tant qu'elle
+        répond, ce qui évite de relire et de réimporter le fichier à chaque utilisation"""
+        if file.get("cdn") and await self.probe(file["cdn"]):
+            return await channel.send(file["cdn"])
+        msg = await channel.send(files=[discord.File(file["path"])])
+        if msg.attachments:
+            file["cdn"] = msg.attachments[0].url
+            await self.save_file(channel.guild, file)
+        return msg
+
+    async def send_batch(self, channel: discord.TextChannel, parts: list):
+        """Envoie dans l'ordre les stickers demandés dans un même message en les regroupant
+
+        Chaque élément est un tuple (type, contenu, suppression) avec type parmi 'text' (lien), 'embed', 'file'
+        (import forcé du fichier local) et 'local' (fichier local, envoyé via son URL du CDN si elle répond encore).
+        Les éléments consécutifs de même type sont envoyés ensemble, par groupe de 10 au maximum. Les fichiers d'un même
+        message ne dépassent pas la taille d'envoi autorisée sur le serveur, un fichier trop lourd est envoyé par son URL."""
+        async def resolve(part):
+            kind, file, delete = part
+            if kind == "local":
+                if file.get("cdn") and await self.probe(file["cdn"]):
+                    return "text", file["cdn"], delete
+                return "file", file, delete
+            return part
+        parts = await asyncio.gather(*[resolve(part) for part in parts])
+
+        limit = channel.guild.filesize_limit
+        groups = []
+        for kind, content, delete in parts:
+            size = 0
+            if kind == "file":
+                size = content.get("size") or self._get_local_file_size(content["path"])
+                if size > limit:
+                    kind, content = "text", content["url"]
+            if kind == "text" and not content: # Fichier importé sans URL dont le fichier local a disparu
+                continue
+            if groups:
+                last_kind, last_delete, items, total = groups[-1]
+                if last_kind == kind and last_delete == delete and len(items) < _BATCH_SIZE:
+                    if (kind == "file" and total + size <= limit) or (kind == "embed" and _MULTI_EMBEDS) or \
+                            (kind == "text" and len("\n".join(items + [content])) <= 2000):
+                        items.append(content)
+                        groups[-1][3] += size
+                        continue
+            groups.append([kind, delete, [content], size])
+
+        for kind, delete, items, _ in groups:
+            delete_after = 10 if delete else None
+            if kind == "text":
+                await channel.send("\n".join(items), delete_after=delete_after)
+            elif kind == "embed":
+                if _MULTI_EMBEDS:
+                    await channel.send(embeds=items, delete_after=delete_after)
+                else:
+                    await channel.send(embed=items[0], delete_after=delete_after)
+            else:
+                try:
+                    msg = await channel.send(files=[discord.File(file["path"], filename=os.path.basename(file["path"]))
+                                                    for file in items], delete_after=delete_after)
+                except Exception:
+                    logger.error("Impossible d'envoyer {}".format(", ".join(file["name"] for file in items)), exc_info=True)
+                    urls = [file["url"] for file in items if file["url"]]
+                    if urls:
+                        await channel.send("\n".join(urls), delete_after=delete_after)
+                    continue
+                for file, attachment in zip(items, msg.attachments):
+                    file["cdn"] = attachment.url
+                    if not file.get("cache"):
+                        await self.save_file(channel.guild, file)
+
+    def cache_path(self, guild: discord.Guild):
+        path = cog_data_path(self) / f"cache/{guild.id}"
+        path.mkdir(exist_ok=True, parents=True)
+        return path
+
+    def _url_key(self, url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def cached_url(self, guild: discord.Guild, file: dict) -> dict:
+        """Renvoie l'entrée du cache local d'un fichier en ligne (ou un dict vide s'il n'est pas en cache)"""
+        entries = self.url_cache.get(guild.id)
+        if not entries:
+            return {}
+        entry = entries.get(self._url_key(file["url"]), {})
+        if entry:
+            entry["last"] = time.time()
+        return entry
+
+    async def load_url_cache(self, guild: discord.Guild) -> dict:
+        """Charge les fichiers déjà présents dans le cache du serveur et supprime ceux qui ne servent plus"""
+        if guild.id in self.url_cache:
+            return self.url_cache[guild.id]
+        sizes = await self.bot.loop.run_in_executor(None, self._scan_folder, str(self.cache_path(guild)))
+        index = await self.get_index(guild)
+        urls = {self._url_key(file["url"]): file for file in index.files.values() if not file["path"]}
+        entries = {}
+        for path, size in sizes.items():
+            key = os.path.splitext(os.path.basename(path))[0]
+            if key in urls:
+                entries[key] = {"name": urls[key]["name"], "path": path, "url": urls[key]["url"], "size": size,
+                                "last": 0, "cache": True}
+            else:
+                self._discard(path)
+        self.url_cache[guild.id] = entries
+        return entries
+
+    async def refresh_url_cache(self, guild: discord.Guild):
+        """Met à jour le cache local des fichiers en ligne du serveur
+
+        Les fichiers les plus utilisés (puis les plus récemment envoyés) sont gardés dans la limite d'octets allouée,
+        les autres sont retirés. Seuls quelques fichiers manquants sont téléchargés à chaque passage."""
+        budget = await self.config.guild(guild).SETTINGS.get_raw("cache_budget")
+        if not budget:
+            if guild.id in self.url_cache:
+                for entry in self.url_cache.pop(guild.id).values():
+                    self._discard(entry["path"])
+            return
+        entries = await self.load_url_cache(guild)
+        index = await self.get_index(guild)
+
+        def rank(file):
+            entry = entries.get(self._url_key(file["url"]), {})
+            return file["count"], entry.get("last", 0)
+
+        candidates = sorted([file for file in index.files.values() if not file["path"] and file["count"]],
+                            key=rank, reverse=True)
+        wanted, used, downloads = set(), 0, 0
+        for file in candidates:
+            key = self._url_key(file["url"])
+            if key in entries:
+                if used + entries[key]["size"] <= budget:
+                    wanted.add(key)
+                    used += entries[key]["size"]
+                continue
+            if downloads >= _CACHE_DOWNLOADS or used >= budget:
+                continue
+            downloads += 1
+            ext = os.path.splitext(urlsplit(file["url"]).path)[1]
+            path = "{}/{}{}".format(str(self.cache_path(guild)), key, ext.lower())
+            try:
+                size = await self.stream_download(file["url"], path, budget - used)
+            except (MaxFileSize, DownloadError):
+                continue
+            except Exception:
+                logger.error("Impossible de mettre en cache {}".format(file["url"]), exc_info=True)
+                continue
+            entries[key] = {"name": file["name"], "path": path, "url": file["url"], "size": size,
+                            "last": 0, "cache": True}
+            wanted.add(key)
+            used += size
+
+        for key in [k for k in entries if k not in wanted]:
+            self._discard(entries.pop(key)["path"])
+
+    def _list_pages(self, guild: discord.Guild, names: list) -> list:
+        emojis = {e.name for e in guild.emojis}
+        pages, txt = [], ""
+        for f in names:
+            base = split_name(f)[0]
+            if f == base:
+                if base not in emojis:
+                    chunk = f"`:{f}:`\n"
+                else:
+                    chunk = f"`:{base}1:`\n"
+            elif f == f"{base}1":
+                chunk = f"`:{base}:`\n"
+            else:
+                chunk = f"∣ `:{f}:`\n"
+            if len(chunk) + len(txt) >= 1950:
+                pages.append(txt)
+                txt = ""
+            txt += chunk
+        pages.append(txt)
+        return pages
+
+    async def get_list_pages(self, guild: discord.Guild, prefix: str = None) -> list:
+        """Renvoie les pages de la liste des fichiers du serveur
+
+        La liste complète est gardée en mémoire jusqu'à la prochaine modification des fichiers ou des emojis du serveur.
+        Avec un préfixe, seuls les noms correspondants sont listés."""
+        index = await self.get_index(guild)
+        if prefix:
+            return self._list_pages(guild, [file["name"] for file in index.similars(prefix)])
+        cached = self.list_cache.get(guild.id)
+        if cached and cached[0] == index.version:
+            return cached[1]
+        pages = self._list_pages(guild, index.names)
+        self.list_cache[guild.id] = (index.version, pages)
+        return pages
+
+    async def send_list(self, user: discord.User, guild: discord.Guild, pages: list, color):
+        for n, txt in enumerate(pages, 1):
+            em = discord.Embed(title=f"Fichiers disponibles sur {guild.name}", description=txt, color=color)
+            em.set_footer(text=f"Page #{n} • Faire ':foobar:' ou ':foobar1:' donne la même chose")
+            try:
+                await user.send(embed=em)
+            except:
+                pass
+
     def any_num(self, s):
         return any(i.isdigit() for i in s)
 
@@ -235,17 +1377,9 @@ class Pixel(commands.Cog):
             await ctx.send("**Nom réservé** • Ce nom est déjà utilisé par le bot pour des fonctionnalités spécifiques.")
             return
 
-        complete_list = await self.files_list(guild)
-        for p in complete_list:
-            base = re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(p)[0][0]
-            if base not in complete_list and f"{base}1" in complete_list:
-                complete_list.append(base)
-            if f"{base}1" in complete_list and base not in complete_list:
-                complete_list.append(f"{base}1")
-
-
-        if name in complete_list:
-            base = re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(name)[0][0]
+        index = await self.get_index(guild)
+        if index.is_taken(name):
+            base = split_name(name)[0]
             if base != name:
                 new_name = await self.find_disp_name(guild, base)
             else:
@@ -263,30 +1397,24 @@ class Pixel(commands.Cog):
             return True
 
         if await access():
-            if name in await self.waiting_list(guild):
-                waiting = await self.config.guild(guild).WAITING()
-                files = await self.config.guild(guild).FILES()
-                wait_file = await self.get_waiting(guild, name)
-                waiting.remove(wait_file)
-                files.append(wait_file)
-                await self.config.guild(guild).WAITING.set(waiting)
-                await self.config.guild(guild).FILES.set(files)
+            wait_file = await self.get_waiting(guild, name)
+            if wait_file:
+                await self.delete_waiting(guild, name)
+                await self.save_file(guild, wait_file)
                 file = await self.get_file(guild, name)
                 em = discord.Embed(description="Fichier `{}` proposé par {} approuvé par {}".format(
                     file["name"], guild.get_member(file["author"]).mention, author.mention), color=em_color)
                 em.set_image(url=file["url"])
                 await ctx.send(embed=em)
             elif url:
-                if self._get_file_type(url) in ["image", "audio", "video"]:
-                    data = await self.config.guild(guild).FILES()
+                if await self._get_file_type(url) in ["image", "audio", "video"]:
                     new = {"name": name,
                            "path": None,
                            "url": url,
                            "author": author.id,
                            "creation": time.time(),
                            "count": 0}
-                    data.append(new)
-                    await self.config.guild(guild).FILES.set(data)
+                    await self.save_file(guild, new)
                     em = discord.Embed(description=f"Fichier `{name}` ajouté avec succès", color=em_color)
                     em.set_image(url=url)
                     em.set_footer(text=f"Utilisez-le avec :{name}: sur les salons autorisés")
@@ -300,7 +1428,7 @@ class Pixel(commands.Cog):
                         await self.download_attachment(ctx.message, name)
                     await ctx.send(f"Fichier `{name}` ajouté avec succès\nUtilisez-le avec :{name}:.")
                     file = await self.get_file(guild, name)
-                    await ctx.send(files=[discord.File(file["path"])])
+                    await self.send_local(ctx.channel, file)
                 except MaxFolderSize:
                     await ctx.send("**Taille maximale du dossier atteinte** • Retirez quelques fichiers parmis ceux "
                                    "qui sont enregistrés en local avant d'en ajouter d'autres.")
@@ -315,15 +1443,13 @@ class Pixel(commands.Cog):
             else:
                 await ctx.send("**Aucun fichier** • Fournissez un fichier pour l'ajouter (URL ou directement téléchargé sur Discord)")
         elif url:
-            data = await self.config.guild(guild).WAITING()
             new = {"name": name,
                    "path": None,
                    "url": url,
                    "author": author.id,
                    "creation": time.time(),
                    "count": 0}
-            data.append(new)
-            await self.config.guild(guild).WAITING.set(data)
+            await self.save_waiting(guild, new)
             em = discord.Embed(description=f"Fichier `{name}` proposé. Un administrateur ou un membre avec la "
                                            f"permission `manage_message` doit l'approuver avec `;pix add {name}`.", color=em_color)
             em.set_image(url=url)
@@ -350,6 +1476,17 @@ class Pixel(commands.Cog):
                 "**Aucun fichier proposé** • Fournissez un fichier pour le proposer "
                 "(URL ou directement téléchargé sur Discord)")
 
+    @_pixel.command(name="list")
+    async def pixel_list(self, ctx, prefix: str = None):
+        """Recevoir en MP la liste des fichiers du serveur
+
+        Si un préfixe est donné, seuls les fichiers dont le nom commence par celui-ci sont listés"""
+        guild = ctx.guild
+        pages = await self.get_list_pages(guild, prefix)
+        if not pages[0]:
+            return await ctx.send("**Aucun fichier** • Aucun fichier ne correspond à ce préfixe.")
+        await self.send_list(ctx.author, guild, pages, await ctx.embed_color())
+
     @_pixel.command(name="remove")
     @checks.admin_or_permissions(manage_messages=True)
     @commands.cooldown(1, 10, commands.BucketType.member)
@@ -362,31 +1499,27 @@ class Pixel(commands.Cog):
         if name in await self.files_list(guild):
             tb = ""
             file = await self.get_file(guild, name)
-            data = await self.config.guild(guild).FILES()
             if file["path"]:
                 try:
-                    os.remove(file["path"])
+                    await self.remove_local(guild, file)
                     tb += "- Fichier local supprimé\n"
-                    data = await self.config.guild(guild).FILES()
-                    index = data.index(file)
-                    file["path"] = None
-                    data[index] = file
-                    await self.config.guild(guild).FILES.set(data)
                 except Exception:
                     logger.error(f"Impossible de supprimer {name}", exc_info=True)
                     tb += "- Fichier local non supprimé\n"
                     pass
             else:
                 tb += "- Aucun fichier local\n"
-            data.remove(file)
+            await self.delete_file(guild, name)
             tb += f"- Données liées à `{name}` supprimées\n"
-            await self.config.guild(guild).FILES.set(data)
             await ctx.send(tb)
-        elif name in await self.waiting_list(guild):
+        elif await self.get_waiting(guild, name):
             wait = await self.get_waiting(guild, name)
-            data = await self.config.guild(guild).WAITING()
-            data.remove(wait)
-            await self.config.guild(guild).WAITING.set(data)
+            await self.delete_waiting(guild, name)
+            if wait["path"]:
+                try:
+                    await self.remove_local(guild, wait)
+                except Exception:
+                    logger.error(f"Impossible de supprimer {name}", exc_info=True)
             await ctx.send("**Proposition refusée** • Proposition de {} pour `{}` supprimée.".format(guild.get_member(
                 wait["author"]).mention, name))
         else:
@@ -394,248 +1527,307 @@ class Pixel(commands.Cog):
 
     @_pixel.command(name="edit")
     @checks.admin_or_permissions(manage_messages=True)
-    @commands.max_concurrency(1, commands.BucketType.member)
     async def pixel_edit(self, ctx, name: str):
         """Editer un fichier du serveur (Nom, URL, fichier local etc.)"""
         author, guild = ctx.author, ctx.guild
-        em_color = await ctx.embed_color()
         if ":" in name:
             await ctx.send("**Nom invalide** • Ne mettez pas `:` autour du nom.")
             return
         if name in await self.files_list(guild):
-            file = {}
-            while True:
-                file = await self.get_file(guild, file["name"] if file else name)
-                name = file["name"]
-                local_txt = "Supprimer/Retélécharger" if file["path"] else "Télécharger depuis URL"
-                size = self.humanize_size(self._get_local_file_size(file["path"])) if file["path"] else "Non téléchargé"
-                crea = datetime.fromtimestamp(file["creation"]).strftime("%d/%m/%Y")
-                auth = guild.get_member(file["author"]).mention
-                count = file["count"]
-                infos = f"**Taille** » {size}\n" \
-                        f"**Date de création** » {crea}\n" \
-                        f"**Auteur** » {auth}\n" \
-                        f"**Utilisations** » {count}"
-                options_txt = "🏷️ · Modifier le nom\n" \
-                              "🔗 · Modifier l'[URL]({})\n" \
-                              "💾 · Gestion du fichier local ({})\n" \
-                              "❌ · Quitter".format(file["url"], local_txt)
-                emojis = ["🏷", "🔗", "💾", "❌"]
-                em = discord.Embed(title=f"Édition de fichier » :{name}:", description=infos, color=em_color)
-                em.add_field(name="Navigation", value=options_txt, inline=False)
-                em.set_image(url=file["url"])
-                em.set_footer(text="Cliquez sur la réaction correspondante à l'action voulue")
+            em_color = await ctx.embed_color()
+            if not self.open_session(guild, author, "edit", lambda session: self.edit_menu(session, ctx, name, em_color)):
+                await ctx.send("**Menu indisponible** • Trop de menus sont déjà ouverts sur ce serveur "
+                               "(ou vous en avez déjà un), réessayez dans quelques instants.")
+        else:
+            await ctx.send("**Fichier inconnu** • Vérifiez le nom que vous avez fourni.\n"
+                           "Sachez que cette commande ne fonctionne pas pour les fichiers en attente d'approbation.")
+
+    def open_session(self, guild, user, kind: str, factory):
+        """Lance un menu interactif dans sa propre tâche
+
+        Renvoie None si le serveur a déjà trop de menus ouverts ou si ce membre a déjà un menu de ce type."""
+        sessions = self.guild_sessions.setdefault(guild.id, set())
+        if len(sessions) >= _MAX_SESSIONS:
+            return None
+        if any(s.user_id == user.id and s.kind == kind for s in sessions):
+            return None
+        session = MenuSession(self.sessions, guild.id, user.id, kind)
+        sessions.add(session)
+
+        def done(task):
+            session.close()
+            sessions.discard(session)
+            if not sessions:
+                self.guild_sessions.pop(guild.id, None)
+            if not task.cancelled() and task.exception():
+                logger.error(f"Erreur dans un menu {kind}", exc_info=task.exception())
+
+        session.task = asyncio.create_task(factory(session))
+        session.task.add_done_callback(done)
+        return session
+
+    async def browse_similars(self, session: MenuSession, channel, base: str, similars: list, em_color):
+        """Menu de navigation entre les fichiers de noms similaires, exécuté dans sa propre session"""
+        page = 0
+        msg = None
+        while True:
+            if page < 0:
+                page = len(similars) - 1
+            elif page == len(similars):
+                page = 0
+
+            em = discord.Embed(title=f"Fichiers similaires » {base}",
+                               description="`:{}:`".format(similars[page]["name"]), color=em_color)
+            em.set_image(url=similars[page]["url"])
+            num = page - 1
+            em.set_footer(text=f"#{num} • Naviguez entre les pages avec les emojis ci-dessous")
+            if not msg:
+                msg = await channel.send(embed=em)
+                start_adding_reactions(msg, ["⬅", "❌", "➡"])
+            else:
+                await msg.edit(embed=em)
+            try:
+                react, user = await session.wait_reaction(msg, timeout=30)
+            except asyncio.TimeoutError:
+                await msg.delete()
+                return
+            emoji = react.emoji
+
+            if emoji == "⬅":
+                page -= 1
+            elif emoji == "❌":
+                await msg.delete()
+                return
+            else:
+                page += 1
+            try:
+                await msg.remove_reaction(emoji, user)
+            except:
+                pass
+
+    async def edit_menu(self, session: MenuSession, ctx, name: str, em_color):
+        """Menu d'édition d'un fichier, exécuté dans sa propre session (voir open_session())"""
+        guild = ctx.guild
+        file = {}
+        while True:
+            file = await self.get_file(guild, file["name"] if file else name)
+            name = file["name"]
+            local_txt = "Supprimer/Retélécharger" if file["path"] else "Télécharger depuis URL"
+            size = self.humanize_size(file.get("size", self._get_local_file_size(file["path"]))) if file["path"] else "Non téléchargé"
+            crea = datetime.fromtimestamp(file["creation"]).strftime("%d/%m/%Y")
+            auth = guild.get_member(file["author"]).mention
+            count = file["count"]
+            infos = f"**Taille** » {size}\n" \
+                    f"**Date de création** » {crea}\n" \
+                    f"**Auteur** » {auth}\n" \
+                    f"**Utilisations** » {count}"
+            options_txt = "🏷️ · Modifier le nom\n" \
+                          "🔗 · Modifier l'[URL]({})\n" \
+                          "💾 · Gestion du fichier local ({})\n" \
+                          "❌ · Quitter".format(file["url"], local_txt)
+            emojis = ["🏷", "🔗", "💾", "❌"]
+            em = discord.Embed(title=f"Édition de fichier » :{name}:", description=infos, color=em_color)
+            em.add_field(name="Navigation", value=options_txt, inline=False)
+            em.set_image(url=file["url"])
+            em.set_footer(text="Cliquez sur la réaction correspondante à l'action voulue")
+            msg = await ctx.send(embed=em)
+            start_adding_reactions(msg, emojis)
+            try:
+                logger.info("En attente de réaction...")
+                react, user = await session.wait_reaction(msg, timeout=30)
+            except asyncio.TimeoutError:
+                await msg.delete()
+                return
+            else:
+                logger.info("Réaction détectée. Traitement...")
+                emoji = react.emoji
+            if emoji == "🏷":
+                await msg.delete()
+                em = discord.Embed(title=f"Édition de fichier » :{name}:",
+                                   description="Quel nouveau nom voulez-vous attribuer à ce fichier ?", color=em_color)
+                em.set_footer(text="Le nom ne doit pas contenir de caractères spéciaux (dont ':') ou d'espaces")
                 msg = await ctx.send(embed=em)
-                start_adding_reactions(msg, emojis)
+
+                def check(msg: discord.Message):
+                    return msg.author == ctx.author and ":" not in msg.content
+
                 try:
-                    logger.info("En attente de réaction...")
-                    react, user = await self.bot.wait_for("reaction_add",
-                                                          check=lambda r, u: u == author and r.message.id == msg.id,
-                                                          timeout=30)
+                    resp = await self.bot.wait_for("message", check=check, timeout=30)
                 except asyncio.TimeoutError:
                     await msg.delete()
-                    return
-                else:
-                    logger.info("Réaction détectée. Traitement...")
-                    emoji = react.emoji
-                if emoji == "🏷":
-                    await msg.delete()
-                    em = discord.Embed(title=f"Édition de fichier » :{name}:",
-                                       description="Quel nouveau nom voulez-vous attribuer à ce fichier ?", color=em_color)
-                    em.set_footer(text="Le nom ne doit pas contenir de caractères spéciaux (dont ':') ou d'espaces")
-                    msg = await ctx.send(embed=em)
-
-                    def check(msg: discord.Message):
-                        return msg.author == ctx.author and ":" not in msg.content
+                    continue
 
-                    try:
-                        resp = await self.bot.wait_for("message", check=check, timeout=30)
-                    except asyncio.TimeoutError:
-                        await msg.delete()
-                        continue
-
-                    new_name = resp.content.replace(" ", "")
-                    if new_name != file["name"]:
-                        if new_name not in await self.files_list(guild) + await self.waiting_list(guild):
-                            data = await self.config.guild(guild).FILES()
-                            index = data.index(file)
-                            file["name"] = new_name
-                            data[index] = file
-                            await self.config.guild(guild).FILES.set(data)
-                            await ctx.send("Modification réalisée avec succès.", delete_after=10)
-                        else:
-                            await ctx.send("Nom déjà utilisé. Retour au menu...", delete_after=10)
+                new_name = resp.content.replace(" ", "")
+                if new_name != file["name"]:
+                    if new_name not in await self.files_list(guild) + await self.waiting_list(guild):
+                        await self.rename_file(guild, file["name"], new_name)
+                        await ctx.send("Modification réalisée avec succès.", delete_after=10)
                     else:
-                        await ctx.send("Nom identique à l'actuel. Retour au menu...", delete_after=10)
-                elif emoji == "🔗":
-                    await msg.delete()
-                    em = discord.Embed(title=f"Édition de fichier » :{name}:",
-                                       description="Fournissez une nouvelle URL valide pour le fichier.", color=em_color)
-                    em.set_footer(text="Utilisez de préférence Imgur et ayez un lien contenant l'extension du fichier")
-                    msg = await ctx.send(embed=em)
-
-                    def check(msg: discord.Message):
-                        return msg.author == ctx.author
+                        await ctx.send("Nom déjà utilisé. Retour au menu...", delete_after=10)
+                else:
+                    await ctx.send("Nom identique à l'actuel. Retour au menu...", delete_after=10)
+            elif emoji == "🔗":
+                await msg.delete()
+                em = discord.Embed(title=f"Édition de fichier » :{name}:",
+                                   description="Fournissez une nouvelle URL valide pour le fichier.", color=em_color)
+                em.set_footer(text="Utilisez de préférence Imgur et ayez un lien contenant l'extension du fichier")
+                msg = await ctx.send(embed=em)
 
-                    try:
-                        resp = await self.bot.wait_for("message", check=check, timeout=120)
-                    except asyncio.TimeoutError:
-                        await msg.delete()
-                        continue
+                def check(msg: discord.Message):
+                    return msg.author == ctx.author
 
-                    if self._get_file_type(resp.content) in ["image", "audio", "video"]:
-                        data = await self.config.guild(guild).FILES()
-                        index = data.index(file)
-                        file["url"] = resp.content
-                        data[index] = file
-                        await self.config.guild(guild).FILES.set(data)
-                        await ctx.send("Modification réalisée avec succès.\n"
-                                       "Si le fichier à afficher n'est plus le même que précédemment, pensez à utiliser "
-                                       "l'option *Retélécharger* dans le menu.", delete_after=15)
-                    else:
-                        await ctx.send("Le fichier contenu dans l'URL donnée n'est pas supporté par le bot "
-                                       "ou Discord.", delete_after=10)
-                elif emoji == "💾":
+                try:
+                    resp = await self.bot.wait_for("message", check=check, timeout=120)
+                except asyncio.TimeoutError:
                     await msg.delete()
-                    while True:
-                        file = await self.get_file(guild, file["name"])
-                        if file["path"]:
-                            options_txt = "🔄 · Retélécharger depuis l'[URL]({})\n" \
-                                          "🧹 · Supprimer le fichier local ({})\n" \
-                                          "❌ · Retour au menu".format(file["url"], file["path"].split("/")[-1])
-                            em = discord.Embed(title=f"Édition de fichier » :{name}:",
-                                               description=options_txt, color=em_color)
-                            em.set_footer(text="Cliquez sur l'emoji correspondant à l'action que vous voulez réaliser")
-                            msg = await ctx.send(embed=em)
-                            emojis = ["🔄", "🧹", "❌"]
-
-                            start_adding_reactions(msg, emojis)
-                            try:
-                                react, user = await self.bot.wait_for("reaction_add", check=lambda r, u: u == author and r.message.id == msg.id, timeout=30)
-                            except asyncio.TimeoutError:
-                                await msg.delete()
-                                return
-                            else:
-                                emoji = react.emoji
+                    continue
+
+                if await self._get_file_type(resp.content) in ["image", "audio", "video"]:
+                    file["url"] = resp.content
+                    await self.save_file(guild, file)
+                    await ctx.send("Modification réalisée avec succès.\n"
+                                   "Si le fichier à afficher n'est plus le même que précédemment, pensez à utiliser "
+                                   "l'option *Retélécharger* dans le menu.", delete_after=15)
+                else:
+                    await ctx.send("Le fichier contenu dans l'URL donnée n'est pas supporté par le bot "
+                                   "ou Discord.", delete_after=10)
+            elif emoji == "💾":
+                await msg.delete()
+                while True:
+                    file = await self.get_file(guild, file["name"])
+                    if file["path"]:
+                        options_txt = "🔄 · Retélécharger depuis l'[URL]({})\n" \
+                                      "🧹 · Supprimer le fichier local ({})\n" \
+                                      "❌ · Retour au menu".format(file["url"], file["path"].split("/")[-1])
+                        em = discord.Embed(title=f"Édition de fichier » :{name}:",
+                                           description=options_txt, color=em_color)
+                        em.set_footer(text="Cliquez sur l'emoji correspondant à l'action que vous voulez réaliser")
+                        msg = await ctx.send(embed=em)
+                        emojis = ["🔄", "🧹", "❌"]
+
+                        start_adding_reactions(msg, emojis)
+                        try:
+                            react, user = await session.wait_reaction(msg, timeout=30)
+                        except asyncio.TimeoutError:
+                            await msg.delete()
+                            return
+                        else:
+                            emoji = react.emoji
 
-                            if emoji == "🔄":
-                                await msg.delete()
-                                try:
-                                    async with ctx.channel.typing():
+                        if emoji == "🔄":
+                            await msg.delete()
+                            try:
+                                old = {"name": file["name"], "path": file["path"], "size": file.get("size"),
+                                       "hash": file.get("hash")}
+                                async with ctx.channel.typing():
+                                    await self.replace_download(guild, file["name"], file["url"])
+                                    if old["path"]: # L'ancien fichier n'est libéré qu'une fois le nouveau en place
                                         try:
-                                            os.remove(file["path"])
-                                            await ctx.send("Ancien fichier local supprimé avec succès", delete_after=10)
+                                            await self.remove_local(guild, old)
                                         except Exception:
-                                            logger.error(f"Impossible de supprimer {name}", exc_info=True)
-                                        await self.replace_download(guild, file["name"], file["url"])
-                                    await ctx.send("Retéléchargement depuis URL réalisé avec succès.", delete_after=10)
-                                except MaxFolderSize:
-                                    await ctx.send(
-                                        "**Taille maximale du dossier atteinte** • Supprimez quelques "
-                                        "fichiers stockés localement d'abord.", delete_after=20)
-                                    continue
-                                except MaxFileSize:
-                                    await ctx.send(
-                                        "**Taille maximale du fichier atteinte** • Le fichier pointé par l'URL est trop lourd, réessayez avec un fichier plus petit que {}.".format(
-                                            self.humanize_size(await self.config.FILE_MAX_SIZE())), delete_after=20)
-                                    continue
-                                except ExtensionNotSupported:
-                                    await ctx.send(
-                                        "**Extension non supportée** • Consultez la liste dans l'aide de la commande d'ajout"
-                                        "(`;help pix add`)", delete_after=20)
-                                    continue
-                                except NameError:
-                                    await ctx.send(
-                                        "**Erreur** • Le nom fourni est le mauvais, "
-                                        "cette erreur ne devrait pas arriver à moins que le stockage soit corrompu", delete_after=20)
-                                    continue
-                                except DownloadError:
-                                    await ctx.send(
-                                        "**Erreur de téléchargement** • Changez l'URL et réessayez", delete_after=20)
-                                    logger.error("Impossible de télécharger depuis {}".format(file["url"]), exc_info=True)
-                                    continue
-
-                            elif emoji == "🧹":
-                                await msg.delete()
-                                file = await self.get_file(guild, file["name"])
-                                if file["path"]:
-                                    try:
-                                        os.remove(file["path"])
-                                        await ctx.send("Fichier local supprimé avec succès", delete_after=10)
-                                    except Exception:
-                                        logger.error(f"Impossible de supprimer {name}", exc_info=True)
-                                        await ctx.send("Impossible de supprimer le fichier local.\n"
-                                                       "Le chemin sera tout de même effacé pour éviter les conflits.", delete_after=15)
-                                    data = await self.config.guild(guild).FILES()
-                                    index = data.index(file)
-                                    file["path"] = None
-                                    data[index] = file
-                                    await self.config.guild(guild).FILES.set(data)
-                                else:
-                                    await ctx.send("Il n'y a aucun fichier local à supprimer", delete_after=10)
-
+                                            logger.error(f"Impossible de supprimer l'ancien fichier de {name}", exc_info=True)
+                                await ctx.send("Retéléchargement depuis URL réalisé avec succès.", delete_after=10)
+                            except MaxFolderSize:
+                                await ctx.send(
+                                    "**Taille maximale du dossier atteinte** • Supprimez quelques "
+                                    "fichiers stockés localement d'abord.", delete_after=20)
+                                continue
+                            except MaxFileSize:
+                                await ctx.send(
+                                    "**Taille maximale du fichier atteinte** • Le fichier pointé par l'URL est trop lourd, réessayez avec un fichier plus petit que {}.".format(
+                                        self.humanize_size(await self.config.FILE_MAX_SIZE())), delete_after=20)
+                                continue
+                            except ExtensionNotSupported:
+                                await ctx.send(
+                                    "**Extension non supportée** • Consultez la liste dans l'aide de la commande d'ajout"
+                                    "(`;help pix add`)", delete_after=20)
+                                continue
+                            except NameError:
+                                await ctx.send(
+                                    "**Erreur** • Le nom fourni est le mauvais, "
+                                    "cette erreur ne devrait pas arriver à moins que le stockage soit corrompu", delete_after=20)
+                                continue
+                            except DownloadError:
+                                await ctx.send(
+                                    "**Erreur de téléchargement** • Changez l'URL et réessayez", delete_after=20)
+                                logger.error("Impossible de télécharger depuis {}".format(file["url"]), exc_info=True)
+                                continue
+
+                        elif emoji == "🧹":
+                            await msg.delete()
+                            file = await self.get_file(guild, file["name"])
+                            if file["path"]:
+                                try:
+                                    await self.remove_local(guild, file)
+                                    await ctx.send("Fichier local supprimé avec succès", delete_after=10)
+                                except Exception:
+                                    logger.error(f"Impossible de supprimer {name}", exc_info=True)
+                                    await ctx.send("Impossible de supprimer le fichier local.\n"
+                                                   "Le chemin sera tout de même effacé pour éviter les conflits.", delete_after=15)
+                                file["path"] = None
+                                await self.save_file(guild, file)
                             else:
-                                await msg.delete()
-                                break
+                                await ctx.send("Il n'y a aucun fichier local à supprimer", delete_after=10)
+
                         else:
-                            options_txt = "📥 · Télécharger depuis l'[URL]({})\n" \
-                                          "❌ · Retour au menu".format(file["url"])
-                            em = discord.Embed(title=f"Édition de fichier » :{name}:",
-                                               description=options_txt, color=em_color)
-                            em.set_footer(text="Cliquez sur l'emoji correspondant à l'action que vous voulez réaliser")
-                            msg = await ctx.send(embed=em)
-                            emojis = ["📥", "❌"]
-
-                            start_adding_reactions(msg, emojis)
-                            try:
-                                react, user = await self.bot.wait_for("reaction_add", check=lambda r, u: u == author and r.message.id == msg.id, timeout=30)
-                            except asyncio.TimeoutError:
-                                await msg.delete()
-                                return
-                            else:
-                                emoji = react.emoji
+                            await msg.delete()
+                            break
+                    else:
+                        options_txt = "📥 · Télécharger depuis l'[URL]({})\n" \
+                                      "❌ · Retour au menu".format(file["url"])
+                        em = discord.Embed(title=f"Édition de fichier » :{name}:",
+                                           description=options_txt, color=em_color)
+                        em.set_footer(text="Cliquez sur l'emoji correspondant à l'action que vous voulez réaliser")
+                        msg = await ctx.send(embed=em)
+                        emojis = ["📥", "❌"]
+
+                        start_adding_reactions(msg, emojis)
+                        try:
+                            react, user = await session.wait_reaction(msg, timeout=30)
+                        except asyncio.TimeoutError:
+                            await msg.delete()
+                            return
+                        else:
+                            emoji = react.emoji
 
-                            if emoji == "📥":
-                                await msg.delete()
-                                try:
-                                    await self.replace_download(guild, file["name"], file["url"])
-                                    await ctx.send("Téléchargement réalisé avec succès.", delete_after=10)
-                                except MaxFolderSize:
-                                    await ctx.send(
-                                        "**Taille maximale du dossier atteinte** • Supprimez quelques "
-                                        "fichiers stockés localement d'abord.", delete_after=20)
-                                    continue
-                                except MaxFileSize:
-                                    await ctx.send(
-                                        "**Taille maximale du fichier atteinte** • Le fichier pointé par l'URL est trop lourd, réessayez avec un fichier plus petit que {}.".format(
-                                            self.humanize_size(await self.config.FILE_MAX_SIZE())), delete_after=20)
-                                    continue
-                                except ExtensionNotSupported:
-                                    await ctx.send(
-                                        "**Extension non supportée** • Consultez la liste dans l'aide de la commande d'ajout"
-                                        "(`;help pix add`)", delete_after=20)
-                                    continue
-                                except NameError:
-                                    await ctx.send(
-                                        "**Erreur** • Le nom fourni est le mauvais, "
-                                        "cette erreur ne devrait pas arriver à moins que le stockage soit corrompu",
-                                        delete_after=20)
-                                    continue
-                                except DownloadError:
-                                    await ctx.send(
-                                        "**Erreur de téléchargement** • Changez l'URL et réessayez", delete_after=20)
-                                    logger.error("Impossible de télécharger depuis {}".format(file["url"]),
-                                                 exc_info=True)
-                                    continue
-                            else:
-                                await msg.delete()
-                                break
-                else:
-                    await msg.delete()
-                    return
-        else:
-            await ctx.send("**Fichier inconnu** • Vérifiez le nom que vous avez fourni.\n"
-                           "Sachez que cette commande ne fonctionne pas pour les fichiers en attente d'approbation.")
+                        if emoji == "📥":
+                            await msg.delete()
+                            try:
+                                await self.replace_download(guild, file["name"], file["url"])
+                                await ctx.send("Téléchargement réalisé avec succès.", delete_after=10)
+                            except MaxFolderSize:
+                                await ctx.send(
+                                    "**Taille maximale du dossier atteinte** • Supprimez quelques "
+                                    "fichiers stockés localement d'abord.", delete_after=20)
+                                continue
+                            except MaxFileSize:
+                                await ctx.send(
+                                    "**Taille maximale du fichier atteinte** • Le fichier pointé par l'URL est trop lourd, réessayez avec un fichier plus petit que {}.".format(
+                                        self.humanize_size(await self.config.FILE_MAX_SIZE())), delete_after=20)
+                                continue
+                            except ExtensionNotSupported:
+                                await ctx.send(
+                                    "**Extension non supportée** • Consultez la liste dans l'aide de la commande d'ajout"
+                                    "(`;help pix add`)", delete_after=20)
+                                continue
+                            except NameError:
+                                await ctx.send(
+                                    "**Erreur** • Le nom fourni est le mauvais, "
+                                    "cette erreur ne devrait pas arriver à moins que le stockage soit corrompu",
+                                    delete_after=20)
+                                continue
+                            except DownloadError:
+                                await ctx.send(
+                                    "**Erreur de téléchargement** • Changez l'URL et réessayez", delete_after=20)
+                                logger.error("Impossible de télécharger depuis {}".format(file["url"]),
+                                             exc_info=True)
+                                continue
+                        else:
+                            await msg.delete()
+                            break
+            else:
+                await msg.delete()
+                return
 
 
     @commands.Cog.listener()
@@ -643,173 +1835,99 @@ class Pixel(commands.Cog):
         if message.guild:
             content = message.content
             guild = message.guild
-            files = await self.config.guild(guild).FILES()
-            if files:
+            index = await self.get_index(guild)
+            if index:
                 if ":" in content:
                     channel, author = message.channel, message.author
                     if author.bot:
                         return
-                    if author.id not in await self.config.guild(guild).SETTINGS.get_raw("users_blacklist"):
-                        if channel.id not in await self.config.guild(guild).SETTINGS.get_raw("channels_blacklist"):
+                    settings = await self.config.guild(guild).SETTINGS()
+                    if author.id not in settings["users_blacklist"]:
+                        if channel.id not in settings["channels_blacklist"]:
                             regex = re.compile(r'([\w?]+)?:(.*?):', re.DOTALL | re.IGNORECASE).findall(content)
                             if regex:
                                 em_color = await self.bot.get_embed_color(channel)
+                                parts = []
+                                flooding = False
                                 for param, name in regex:
-                                    all_files = await self.files_list(guild)
                                     if name not in ["list", "liste"]:
-                                        if name not in all_files:
-                                            if name + "1" in all_files:
-                                                name = f"{name}1"
-                                            else:
-                                                base, num = re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(name)[0]
-                                                if num == "1" and base in all_files:
-                                                    name = base
-
-                                    if name in all_files:
+                                        name = index.resolve(name) or name
+
+                                    if name in index:
                                         if name in [e.name for e in guild.emojis]:
                                             continue
 
-                                        file = await self.get_file(guild, name)
-                                        data = await self.config.guild(guild).FILES()
-                                        index = data.index(file)
-                                        file["count"] += 1
-                                        data[index] = file
-                                        await self.config.guild(guild).FILES.set(data)
+                                        if settings["antiflood"]:
+                                            if not self.flood.consume((guild.id, author.id), settings["flood_rate"],
+                                                                      settings["flood_burst"]):
+                                                if not flooding:
+                                                    flooding = True
+                                                    await channel.send("{} **Cooldown** • Patientez quelques secondes "
+                                                                       "avant de poster d'autres fichiers...".format(author.mention),
+                                                                       delete_after=10)
+                                                continue
+
+                                        file = index.get(name)
+                                        self.add_use(guild, file)
 
                                         suppr = False
                                         if param:
                                             if "b" in param: # Donner le fichier lié à la "base" du nom
-                                                base, num = \
-                                                re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(name)[
-                                                    0]
-                                                new_file = await self.get_file(guild, base)
+                                                base, num = split_name(name)
+                                                new_file = index.get(base)
                                                 if new_file:
                                                     file = new_file
                                             if "s" in param: # Affiche un menu avec tous les fichiers de noms similaires
-                                                base, num = \
-                                                re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(name)[
-                                                    0]
-                                                similars = await self.get_similars(guild, base)
+                                                base, num = split_name(name)
+                                                similars = index.similars(base)
                                                 if len(similars) > 1:
-                                                    index = 0
-                                                    msg = None
-                                                    while True:
-                                                        if index < 0:
-                                                            index = len(similars) - 1
-                                                        elif index == len(similars):
-                                                            index = 0
-
-                                                        em = discord.Embed(title=f"Fichiers similaires » {base}",
-                                                                           description="`:{}:`".format(similars[index]["name"]), color=em_color)
-                                                        em.set_image(url=similars[index]["url"])
-                                                        num = index - 1
-                                                        em.set_footer(
-                                                            text=f"#{num} • Naviguez entre les pages avec les emojis ci-dessous")
-                                                        if not msg:
-                                                            msg = await channel.send(embed=em)
-                                                        else:
-                                                            await msg.edit(embed=em)
-                                                        emojis = ["⬅", "❌", "➡"]
-                                                        start_adding_reactions(msg, emojis)
-                                                        try:
-                                                            react, user = await self.bot.wait_for("reaction_add",
-                                                                                                  check=lambda r, u: u == author and r.message.id == msg.id,
-                                                                                                  timeout=30)
-                                                        except asyncio.TimeoutError:
-                                                            await msg.delete()
-                                                            return
-                                                        else:
-                                                            emoji = react.emoji
-
-                                                        if emoji == "⬅":
-                                                            index -= 1
-                                                        elif emoji == "❌":
-                                                            await msg.delete()
-                                                            return
-                                                        else:
-                                                            index += 1
-                                                        try:
-                                                            await msg.remove_reaction(emoji, user)
-                                                        except:
-                                                            pass
+                                                    self.open_session(guild, author, "similars",
+                                                                      lambda session: self.browse_similars(
+                                                                          session, channel, base, similars, em_color))
+                                                    continue
                                             if "?" in param:
-                                                base, num = \
-                                                re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(name)[
-                                                    0]
-                                                similars = await self.get_similars(guild, base)
+                                                base, num = split_name(name)
+                                                similars = index.similars(base)
                                                 file = random.choice(similars)
                                             if "e" in param:
                                                 em = discord.Embed(color=em_color)
                                                 em.set_image(url=file["url"])
-                                                await channel.send(embed=em)
+                                                parts.append(("embed", em, False))
                                                 continue
                                             if "u" in param:
                                                 if file["path"]:
-                                                    try:
-                                                        await channel.send(files=[discord.File(file["path"])])
-                                                        continue
-                                                    except:
-                                                        logger.error(f"Impossible d'envoyer {name}", exc_info=True)
+                                                    parts.append(("file", file, False))
+                                                    continue
                                             if "w" in param:
-                                                await channel.send(file["url"])
+                                                parts.append(("text", file["url"], False))
+                                                continue
                                             if "!" in param:
                                                 suppr = True
 
-                                        async with channel.typing():
-                                            if await self.config.guild(guild).SETTINGS.get_raw("antiflood"):
-                                                ts = time.strftime("%H:%M", time.localtime())
-                                                if ts not in self.cooldown:
-                                                    self.cooldown = {ts: []}
-                                                self.cooldown[ts].append(author.id)
-                                                if self.cooldown[ts].count(author.id) > 3:
-                                                    await channel.send("{} **Cooldown** • Patientez quelques secondes "
-                                                                       "avant de poster d'autres fichiers...".format(author.mention))
-
-                                            if file["path"]:
-                                                try:
-                                                    await channel.send(files=[discord.File(file["path"])])
-                                                    continue
-                                                except:
-                                                    logger.error(f"Impossible d'envoyer {name}", exc_info=True)
-                                        if not suppr:
-                                            await channel.send(file["url"])
+                                        cached = self.cached_url(guild, file) if not file["path"] and not suppr else {}
+                                        if file["path"]:
+                                            parts.append(("local", file, False))
+                                        elif cached:
+                                            parts.append(("local", cached, False))
                                         else:
-                                            await channel.send(file["url"], delete_after=10)
+                                            parts.append(("text", file["url"], suppr))
 
                                     elif name.lower() in ["list", "liste"]:
-                                        async with channel.typing():
-                                            txt = ""
-                                            n = 1
-                                            liste = sorted(await self.files_list(guild))
-                                            for f in liste:
-                                                base = re.compile(r"([A-z]+)(\d*)?", re.DOTALL | re.IGNORECASE).findall(f)[0][0]
-                                                if f == base:
-                                                    if base not in [e.name for e in guild.emojis]:
-                                                        chunk = f"`:{f}:`\n"
-                                                    else:
-                                                        chunk = f"`:{base}1:`\n"
-                                                elif f == f"{base}1":
-                                                    chunk = f"`:{base}:`\n"
-                                                else:
-                                                    chunk = f"∣ `:{f}:`\n"
-                                                if len(chunk) + len(txt) >= 1950:
-                                                    em = discord.Embed(title=f"Fichiers disponibles sur {guild.name}",
-                                                                       description=txt, color=em_color)
-                                                    em.set_footer(text=f"Page #{n} • Faire ':foobar:' ou ':foobar1:' donne la même chose")
-                                                    try:
-                                                        await author.send(embed=em)
-                                                    except:
-                                                        pass
-                                                    txt = ""
-                                                    n += 1
-                                                txt += chunk
-                                            em = discord.Embed(title=f"Fichiers disponibles sur {guild.name}",
-                                                               description=txt, color=em_color)
-                                            em.set_footer(text=f"Page #{n} • Faire ':foobar:' ou ':foobar1:' donne la même chose")
-                                            try:
-                                                await author.send(embed=em)
-                                            except:
-                                                pass
+                                        await self.send_list(author, guild, await self.get_list_pages(guild), em_color)
+
+                                if parts:
+                                    async with channel.typing():
+                                        await self.send_batch(channel, parts)
+
+    @commands.Cog.listener()
+    async def on_reaction_add(self, reaction, user):
+        session = self.sessions.get(reaction.message.id)
+        if session and user.id == session.user_id:
+            session.queue.put_nowait((reaction, user))
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.list_cache.pop(guild.id, None)
 
     @commands.group()
     @checks.is_owner()
@@ -834,6 +1952,65 @@ class Pixel(commands.Cog):
         else:
             await ctx.send("**Taille maximale des dossiers serveurs** • Le minimum possible est 1 MB (1000000 B)")
 
+    @pixellocal.command(name="optimize")
+    async def optimize_toggle(self, ctx):
+        """Active/Désactive l'optimisation des images importées (PNG, GIF et JPEG)"""
+        if Image is None:
+            return await ctx.send("**Optimisation indisponible** • Installez `Pillow` pour utiliser cette fonctionnalité.")
+        val = await self.config.OPTIMIZE()
+        await self.config.OPTIMIZE.set(not val)
+        if val:
+            await ctx.send("**Optimisation** • Les images importées seront stockées telles quelles.")
+        else:
+            await ctx.send("**Optimisation** • Les images importées seront désormais optimisées.")
+
+    @pixellocal.command()
+    async def maxside(self, ctx, value: int):
+        """Change la taille maximale (en pixels) du plus grand côté des images optimisées"""
+        if value >= 128:
+            await self.config.OPTIMIZE_MAX_SIDE.set(value)
+            await ctx.send("**Taille maximale des images** • Réglé à {}px".format(value))
+        else:
+            await ctx.send("**Taille maximale des images** • Le minimum possible est 128px")
+
+    @pixellocal.command()
+    async def reconcile(self, ctx):
+        """Recalcule l'espace occupé par chaque serveur à partir des fichiers présents sur le disque"""
+        txt = ""
+        async with ctx.typing():
+            for guild in self.bot.guilds:
+                before = await self.config.guild(guild).STORAGE()
+                if before is None and not (cog_data_path(self) / f"local/{guild.id}").is_dir():
+                    continue
+                after = await self.reconcile_storage(guild)
+                if before != after:
+                    before = self.humanize_size(before) if before is not None else "Inconnu"
+                    txt += f"**{guild.name}** » {before} → {self.humanize_size(after)}\n"
+            freed = await self.collect_blobs()
+            if freed:
+                txt += f"**Fichiers inutilisés supprimés** » {self.humanize_size(freed)}\n"
+        if txt:
+            for page in pagify(txt):
+                await ctx.send(page)
+        else:
+            await ctx.send("**Registre à jour** • Aucune différence avec le disque n'a été trouvée.")
+
+    @pixellocal.command()
+    async def scan(self, ctx):
+        """Vérifie l'intégrité du stockage local (fichiers orphelins et chemins invalides)"""
+        async with ctx.typing():
+            report = await self.scan_integrity()
+        if report is None:
+            await ctx.send("**Vérification impossible** • Un import ou une autre vérification est en cours, "
+                           "réessayez dans quelques instants.")
+        elif report["orphans"] or report["dangling"]:
+            await ctx.send("**Vérification terminée** • {} fichiers orphelins supprimés ({} libérés), "
+                           "{} références invalides retirées.".format(report["orphans"],
+                                                                      self.humanize_size(report["freed"]),
+                                                                      report["dangling"]))
+        else:
+            await ctx.send("**Vérification terminée** • Aucun problème n'a été trouvé.")
+
 
     @commands.group(aliases=["pixset"])
     @commands.guild_only()
@@ -852,9 +2029,9 @@ class Pixel(commands.Cog):
         else:
             await ctx.send("**Approbation** • Proposer un fichier nécessitera désormais l'approbation de la modération.")
 
-    @pixelset.command()
+    @pixelset.group(invoke_without_command=True)
     async def antiflood(self, ctx):
-        """Active/Désactive l'antiflood (3 fichiers / minute / membre)"""
+        """Active/Désactive l'antiflood (par défaut 3 fichiers / minute / membre)"""
         guild = ctx.guild
         val = await self.config.guild(guild).SETTINGS.get_raw("antiflood")
         await self.config.guild(guild).SETTINGS.set_raw("antiflood", value=not val)
@@ -864,18 +2041,48 @@ class Pixel(commands.Cog):
             await ctx.send(
                 "**Anti-flood** • La fonctionnalité est maintenant activée.")
 
+    @antiflood.command(name="rate")
+    async def antiflood_rate(self, ctx, rate: int, burst: int = None):
+        """Règle le nombre de fichiers autorisés par minute et par membre
+
+        [burst] est le nombre de fichiers pouvant être envoyés d'affilée (par défaut égal à <rate>)"""
+        guild = ctx.guild
+        burst = burst if burst else rate
+        if not 1 <= rate <= 60 or not 1 <= burst <= 60:
+            return await ctx.send("**Anti-flood** • Les valeurs doivent être comprises entre 1 et 60.")
+        await self.config.guild(guild).SETTINGS.set_raw("flood_rate", value=rate)
+        await self.config.guild(guild).SETTINGS.set_raw("flood_burst", value=burst)
+        await ctx.send(f"**Anti-flood** • Limite réglée à {rate} fichiers par minute (rafale de {burst} maximum).")
+
+    @pixelset.command(name="cache")
+    async def url_cache_budget(self, ctx, value: float):
+        """Change l'espace (en MB) alloué au cache local des fichiers ajoutés par URL
+
+        Les fichiers les plus utilisés sont téléchargés en arrière-plan pour être envoyés même si leur hébergeur
+        ne répond plus. Mettre 0 désactive le cache et le vide."""
+        guild = ctx.guild
+        value = int(value * 1e6)
+        if value < 0 or value > await self.config.FOLDER_MAX_SIZE():
+            return await ctx.send("**Cache** • La valeur doit être comprise entre 0 et {}".format(
+                self.humanize_size(await self.config.FOLDER_MAX_SIZE())))
+        await self.config.guild(guild).SETTINGS.set_raw("cache_budget", value=value)
+        if value:
+            await ctx.send("**Cache** • {} alloués au cache des fichiers ajoutés par URL.".format(self.humanize_size(value)))
+        else:
+            await self.refresh_url_cache(guild)
+            await ctx.send("**Cache** • Le cache des fichiers ajoutés par URL est désactivé.")
+
     @pixelset.command(name="size")
     async def guildsize(self, ctx):
         """Affiche une liste des 10 fichiers les plus lourds et la place totale prise par le serveur"""
         guild = ctx.guild
         em_color = await ctx.embed_color()
         big = []
-        liste = await self.files_list(guild)
-        data = await self.config.guild(guild).FILES() + await self.config.guild(guild).WAITING()
-        for f in liste:
-            file = [i for i in data if i["name"] == f][0]
+        storage = await self.get_storage(guild)
+        index = await self.get_index(guild)
+        for file in index.files.values():
             if file["path"]:
-                big.append((f, self._get_local_file_size(file["path"])))
+                big.append((file["name"], file.get("size", 0)))
         if big:
             big = sorted(big, key=operator.itemgetter(1), reverse=True)[:10]
             txt = ""
@@ -884,9 +2091,13 @@ class Pixel(commands.Cog):
                 txt += f"**{name}** » {t}\n"
             if txt:
                 em = discord.Embed(title="10 fichiers les plus lourds stockés localement", description=txt, color=em_color)
-                em.set_footer(text="Total occupé par ce serveur = {} / {} disponibles".format(
-                    self.humanize_size(self._get_folder_size(await self.guild_path(guild))),
-                    self.humanize_size(await self.config.FOLDER_MAX_SIZE())))
+                footer = "Total occupé par ce serveur = {} / {} disponibles".format(
+                    self.humanize_size(storage),
+                    self.humanize_size(await self.config.FOLDER_MAX_SIZE()))
+                saved = await self.config.guild(guild).SAVED()
+                if saved:
+                    footer += " • {} économisés par l'optimisation".format(self.humanize_size(saved))
+                em.set_footer(text=footer)
                 await ctx.send(embed=em)
             else:
                 await ctx.send("**Aucune donnée à afficher** » Il semblerait qu'aucun fichier "
@@ -924,6 +2135,56 @@ class Pixel(commands.Cog):
         else:
             await ctx.send("**Blacklist de membres** • *{}* n'est pas présent dans la blacklist.".format(user.name))
 
+    @pixelset.command(name="export")
+    @commands.cooldown(1, 600, commands.BucketType.guild)
+    async def pack_export(self, ctx):
+        """Exporte les fichiers du serveur dans une archive zip (à importer avec `;pixelset import`)"""
+        guild = ctx.guild
+        async with ctx.typing():
+            path, count, size = await self.export_pack(guild)
+        try:
+            if size <= guild.filesize_limit:
+                await ctx.send(f"**Export terminé** • {count} fichiers exportés.", file=discord.File(path))
+            else:
+                await ctx.send(f"**Export impossible** • L'archive de {count} fichiers ({self.humanize_size(size)}) "
+                               f"est trop lourde pour être envoyée sur ce serveur "
+                               f"(limite de {self.humanize_size(guild.filesize_limit)}).")
+        finally:
+            self._discard(path)
+
+    @pixelset.command(name="import")
+    async def pack_import(self, ctx):
+        """Importe les fichiers d'une archive créée avec `;pixelset export`
+
+        L'archive doit être jointe au message de la commande. Les fichiers dont le nom est déjà pris sont ignorés."""
+        guild = ctx.guild
+        if not ctx.message.attachments or not ctx.message.attachments[0].filename.lower().endswith(".zip"):
+            return await ctx.send("**Archive manquante** • Joignez l'archive `.zip` à votre message.")
+        attachment = ctx.message.attachments[0]
+        limit = await self.config.FOLDER_MAX_SIZE() + 1e6
+        if attachment.size > limit:
+            return await ctx.send("**Archive trop lourde** • Elle dépasse l'espace disponible pour un serveur.")
+        archive = self.temp_path("import.zip")
+        try:
+            async with ctx.typing():
+                await self.stream_download(attachment.url, archive, limit)
+                report = await self.import_pack(guild, ctx.author, archive)
+        except InvalidArchive:
+            return await ctx.send("**Archive invalide** • Ce fichier n'est pas une archive exportée par Pixel.")
+        except MaxFolderSize:
+            return await ctx.send("**Taille maximale du dossier atteinte** • Les fichiers de cette archive dépassent "
+                                  "l'espace restant pour ce serveur.")
+        except (DownloadError, MaxFileSize):
+            return await ctx.send("**Import impossible** • L'archive n'a pas pu être téléchargée ou est corrompue.")
+        finally:
+            self._discard(archive)
+        txt = "**Import terminé** • {} fichiers ajoutés.".format(len(report["added"]))
+        if report["skipped"]:
+            txt += "\nIgnorés (nom déjà pris, invalide ou fichier non supporté) : {}".format(
+                ", ".join(f"`{name}`" for name in report["skipped"]))
+        for page in pagify(txt):
+            await ctx.send(page)
+
     @pixelset.group()
     @checks.admin_or_permissions(ban_members=True)
     async def channelblacklist(self, ctx):